@@ -25,7 +25,6 @@ snapshot_path = ''
 
 crop_size = 512
 image_ratio = 0.5
-prefetch = 1000
 threads = 8
 
 lr_start = 1e-4
@@ -41,7 +40,6 @@ with tf.Session(config=config) as sess:
         crop_size = crop_size,
         ratio = image_ratio,
         batch_size = batch_size,
-        prefetch = prefetch,
         n_threads = 8,
         n_classes = 2,
         sess = sess )
@@ -0,0 +1,74 @@
+from __future__ import print_function
+import numpy as np
+import time
+import unittest
+
+try:
+    import tensorflow as tf
+except ImportError:
+    tf = None
+
+"""
+DeviceStager latency test on a CPU stand-in device
+
+The producer sleeps `delay` seconds per batch (a tf.py_func) and the "step"
+sleeps `compute` seconds on the batch it is given. Fed directly from the
+producer, a step costs delay + compute. With the stager, the put for the next
+batch runs in the same sess.run as the step, concurrently, so a step should
+cost about max(delay, compute).
+"""
+
+@unittest.skipIf(tf is None, 'tensorflow is not installed')
+class DeviceStagerLatencyTest(unittest.TestCase):
+    delay = 0.2
+    compute = 0.2
+    n_steps = 5
+    shape = [2, 8, 8, 3]
+
+    def _sleep_op(self, seconds, x=None):
+        def fn(*args):
+            time.sleep(seconds)
+            return np.zeros(self.shape, dtype=np.float32)
+        out = tf.py_func(fn, [] if x is None else [x], tf.float32, stateful=True)
+        out.set_shape(self.shape)
+        return out
+
+
+    def _mean_step(self, sess, fetches):
+        sess.run(fetches)
+        tstart = time.time()
+        for _ in range(self.n_steps):
+            sess.run(fetches)
+        return (time.time() - tstart) / self.n_steps
+
+
+    def test_staged_step_overlaps_transfer(self):
+        from tfmodels.utilities.staging import DeviceStager
+
+        class SlowDataset(object):
+            pass
+
+        graph = tf.Graph()
+        with graph.as_default():
+            dataset = SlowDataset()
+            dataset.image_op = self._sleep_op(self.delay)
+            stager = DeviceStager(dataset, device='/cpu:0', capacity=2)
+
+            unstaged_step = self._sleep_op(self.compute, dataset.image_op)
+            staged_step = self._sleep_op(self.compute, stager.image_op)
+
+            config = tf.ConfigProto(inter_op_parallelism_threads=4)
+            with tf.Session(graph=graph, config=config) as sess:
+                unstaged = self._mean_step(sess, unstaged_step)
+
+                stager.prime(sess)
+                staged = self._mean_step(sess, [staged_step, stager.put_op])
+                self.assertEqual(sess.run(stager.size_op), 1)
+
+        print('unstaged {:3.3f}s/step staged {:3.3f}s/step'.format(unstaged, staged))
+        self.assertGreater(unstaged, 0.9 * (self.delay + self.compute))
+        self.assertLess(staged, 0.75 * (self.delay + self.compute))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+from __future__ import print_function
+import numpy as np
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    import tensorflow as tf
+except ImportError:
+    tf = None
+
+"""
+SVSFeeder reader threads, tile / coordinate round-trip and the foreground cache,
+on a NumpySlide. Tiles are pulled straight from the python generator that feeds
+tf.data, so no session is needed; tensorflow is only required to import tfmodels.
+"""
+
+def _slide_image(h=384, w=640):
+    ## White glass with a saturated pink block of "tissue" in the upper left
+    image = np.full((h, w, 3), 255, dtype=np.uint8)
+    image[32:224, 48:320] = [200, 60, 150]
+    ## Texture, so every tile is distinguishable
+    rng = np.random.RandomState(0)
+    image[32:224, 48:320] -= rng.randint(0, 30, (192, 272, 1)).astype(np.uint8)
+    return image
+
+
+@unittest.skipIf(tf is None, 'tensorflow is not installed')
+class SVSFeederTest(unittest.TestCase):
+    def setUp(self):
+        from tfmodels.utilities.datasets.svs_feeder import NumpySlide
+
+        self.tmpdir = tempfile.mkdtemp()
+        self.image = _slide_image()
+        self.thumbnail_calls = [0]
+        thumbnail_calls = self.thumbnail_calls
+
+        class CountingSlide(NumpySlide):
+            def get_thumbnail(self, size):
+                thumbnail_calls[0] += 1
+                return super(CountingSlide, self).get_thumbnail(size)
+
+        self.slide_reader = lambda path: CountingSlide(self.image, level_count=3)
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+
+    def _feeder(self, **kwargs):
+        from tfmodels.utilities.datasets.svs_feeder import SVSFeeder
+        settings = {'svsfile': os.path.join(self.tmpdir, 'slide.svs'),
+                    'slide_reader': self.slide_reader,
+                    'cache_dir': self.tmpdir,
+                    'level': 1,
+                    'tile_size': 64,
+                    'downsample': 1.0,
+                    'n_threads': 3,
+                    'prefetch': 4}
+        settings.update(kwargs)
+        return SVSFeeder(**settings)
+
+
+    def test_tiles_match_their_coordinates(self):
+        feeder = self._feeder(find_foreground=False)
+        slide = self.slide_reader(None)
+
+        seen = []
+        for tile, coord in feeder._generator():
+            expected = slide.read_region(tuple(coord), feeder.level,
+                (feeder.tile_size, feeder.tile_size))[:, :, :3]
+            np.testing.assert_array_equal(tile, expected)
+            seen.append(tuple(coord))
+
+        ## Every coordinate exactly once, whatever order the readers finished in
+        self.assertEqual(sorted(seen), sorted(feeder.coords))
+        self.assertEqual(len(seen), len(set(seen)))
+
+
+    def test_foreground_cache_hit(self):
+        first = self._feeder()
+        self.assertEqual(self.thumbnail_calls[0], 1)
+        cache_path = first._foreground_cache_path()
+        self.assertTrue(os.path.exists(cache_path))
+        self.assertGreater(len(first.coords), 0)
+        self.assertLess(len(first.coords), np.prod(first.grid_shape))
+
+        second = self._feeder()
+        ## Served from the cache: no new thumbnail, same tiles and mask
+        self.assertEqual(self.thumbnail_calls[0], 1)
+        self.assertEqual(second.coords, first.coords)
+        np.testing.assert_array_equal(second.tissue_mask, first.tissue_mask)
+        np.testing.assert_array_equal(second.foreground_index, first.foreground_index)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -210,11 +210,25 @@ class Classifier(BaseModel):
         #         [self.loss_sum_test, self.x_in_sum_test,
         #          self.y_in_sum_test, self.y_hat_sum_test])
 
-    def _write_scalar_summaries(self, lr=None):
-        if lr is None: lr='constant'
-        summary_str, class_loss_ = self.sess.run([self.summary_scalars_op, self.class_loss])
+    """ Summary fetches due at the current global_step, run with the training step """
+    def _summary_fetches(self):
+        fetches = {}
+        if self.global_step % self.summary_iters == 0:
+            fetches['scalars'] = [self.summary_scalars_op, self.class_loss]
+        return fetches
+
+
+    def _write_summaries(self, fetched):
+        if 'scalars' in fetched:
+            self._write_scalar_summaries(*fetched['scalars'])
+
+
+    def _write_scalar_summaries(self, summary_str=None, class_loss_=None, lr=None):
+        lr = 'constant' if lr is None else '{:03E}'.format(lr)
+        if summary_str is None:
+            summary_str, class_loss_ = self.sess.run([self.summary_scalars_op, self.class_loss])
         self.summary_writer.add_summary(summary_str, self.global_step)
-        print('[{:07d}] writing scalar summaries (loss={:3.3f}) (lr={:03E})'.format(self.global_step, class_loss_, lr))
+        print('[{:07d}] writing scalar summaries (loss={:3.3f}) (lr={})'.format(self.global_step, class_loss_, lr))
 
 
     # def _write_image_summaries(self):
@@ -244,10 +258,12 @@ class Classifier(BaseModel):
 
     def train_step(self, keep_prob=1.0):
         self.global_step += 1
-        self.sess.run(self.class_training_op_list)
-
-        if self.global_step % self.summary_iters == 0:
-            self._write_scalar_summaries()
+        fetches = self._summary_fetches()
+        fetches['train'] = self.class_training_op_list
+        fetched = self.profiler.run(self.sess, fetches)
+        with self.profiler.phase('summaries'):
+            self._write_summaries(fetched)
+        self.profiler.end_step(self.global_step, getattr(self.dataset, 'batch_size', None))
 
         # if self.global_step % self.summary_image_iters == 0:
         #     self._write_image_summaries()
@@ -263,11 +263,14 @@ class GAN(BaseModel):
     def train_step(self):
         self.global_step += 1
         # if self.iterator_dataset:
-        feed_dict = {self.x_in: next(self.dataset.iterator)}
-        self.sess.run(self.gan_train_op_list, feed_dict=feed_dict)
+        with self.profiler.phase('input'):
+            feed_dict = {self.x_in: next(self.dataset.iterator)}
+        self.profiler.run(self.sess, self.gan_train_op_list, feed_dict=feed_dict)
         # else:
         #     self.sess.run(self.train_op)
 
         if self.global_step % self.summary_iters == 0:
-            summary_str = self.sess.run(self.summary_op, feed_dict=feed_dict)
-            self.summary_writer.add_summary(summary_str, self.global_step)
+            with self.profiler.phase('summaries'):
+                summary_str = self.sess.run(self.summary_op, feed_dict=feed_dict)
+                self.summary_writer.add_summary(summary_str, self.global_step)
+        self.profiler.end_step(self.global_step, self.batch_size)
@@ -258,15 +258,21 @@ class WGAN(BaseModel):
     def train_step(self):
         self.global_step += 1
 
+        ## Only the generator run is traced, so input_wait counts one run per step
         for _ in range(self.critic_overtrain):
-            feed_dict = {self.x_in: next(self.dataset.iterator)}
-            self.sess.run([self.dis_train_op, self.clip_D], feed_dict=feed_dict)
+            with self.profiler.phase('input'):
+                feed_dict = {self.x_in: next(self.dataset.iterator)}
+            self.profiler.run(self.sess, [self.dis_train_op, self.clip_D], feed_dict=feed_dict,
+                phase='critic', trace=False)
             # self.sess.run(self.clip_D)
 
 
-        feed_dict = {self.x_in: next(self.dataset.iterator)}
-        self.sess.run(self.gen_train_op, feed_dict=feed_dict)
+        with self.profiler.phase('input'):
+            feed_dict = {self.x_in: next(self.dataset.iterator)}
+        self.profiler.run(self.sess, self.gen_train_op, feed_dict=feed_dict)
 
         if self.global_step % self.summary_iters == 0:
-            summary_str = self.sess.run(self.summary_op, feed_dict=feed_dict)
-            self.summary_writer.add_summary(summary_str, self.global_step)
+            with self.profiler.phase('summaries'):
+                summary_str = self.sess.run(self.summary_op, feed_dict=feed_dict)
+                self.summary_writer.add_summary(summary_str, self.global_step)
+        self.profiler.end_step(self.global_step, self.batch_size * (self.critic_overtrain + 1))
@@ -7,6 +7,7 @@ from .vgg import VGGTraining, VGGInference
 from .fcn8s import FCNTraining, FCNInference
 from .resnet import ResNetTraining, ResNetInference
 from .densenet import DenseNetTraining, DenseNetInference
+from .ensemble import SegmentationEnsemble
 # from resnet_bottleneck import ResNetBottleneckTraining, ResNetBottleneckInference
 
 
@@ -24,4 +25,5 @@ __all__ = ['Segmentation',
            'ResNetInference',
            'DenseNetTraining',
            'DenseNetInference',
+           'SegmentationEnsemble',
        ]
@@ -0,0 +1,211 @@
+from __future__ import print_function
+import tensorflow as tf
+import numpy as np
+import collections
+import csv
+import datetime
+import importlib
+import json
+import platform
+import shutil
+import tempfile
+import time
+
+"""
+Forward / backward cost of the segmentation architectures
+
+Every model is built in TEST and TRAIN mode over a grid of x_dims and batch
+sizes, each in a fresh graph, on synthetic inputs:
+
+    results = benchmark_models(models=['VGG', 'DenseNet'], x_dims=[[256, 256, 3]],
+        batch_sizes=[1, 8], output='model_benchmark')
+
+writes model_benchmark.csv and model_benchmark.json, one row per configuration:
+    build_s          graph construction + variable initialization
+    params           _count_params()
+    gflops           per batch, from tf.profiler on a traced run. TRAIN includes
+                     the backward pass and optimizer update
+    p50_ms / mean_ms latency of one inference sess.run (TEST) or train_op (TRAIN)
+    images_per_sec   batch_size / mean latency
+
+Models that fail to import or build are recorded with their error and skipped.
+
+    python -m tfmodels.segmentation.benchmark --models VGG ResNet --batch_sizes 1 8
+"""
+
+## name: (module, training class, inference class)
+## module None: the classes are returned by a builder function in this file
+MODELS = collections.OrderedDict([
+    ('DenseNet', ('densenet', 'DenseNetTraining', 'DenseNetInference')),
+    ('IntermediateNet', ('intermediate', 'IntermediateNetTraining', 'IntermediateNetInference')),
+    ('ResNet', ('resnet', 'ResNetTraining', 'ResNetInference')),
+    ('SegNet', ('segnet', 'SegNetTraining', 'SegNetInference')),
+    ('VGG', ('vgg', 'VGGTraining', 'VGGInference')),
+    ('FCN', ('fcn8s', 'FCNTraining', 'FCNInference')),
+    ('SegmentationBayesian', (None, '_bayesian_resnet', '_bayesian_resnet')),
+])
+
+COLUMNS = ['model', 'mode', 'x_dims', 'batch_size', 'build_s', 'params', 'gflops',
+           'p50_ms', 'mean_ms', 'images_per_sec', 'error']
+
+
+""" Stands in for a TFRecord dataset: one random batch, repeated """
+class SyntheticSegmentationDataset(object):
+    def __init__(self, x_dims, n_classes, batch_size):
+        self.batch_size = batch_size
+        self.testing_record = None
+        image = np.random.uniform(-1, 1, [batch_size] + list(x_dims)).astype(np.float32)
+        labels = np.random.randint(0, n_classes, [batch_size] + list(x_dims[:2]))
+        mask = np.eye(n_classes, dtype=np.float32)[labels]
+
+        self.dataset = tf.data.Dataset.from_tensors((image, mask)).repeat()
+        self.iterator = self.dataset.make_one_shot_iterator()
+        self.image_op, self.mask_op = self.iterator.get_next()
+
+
+""" SegmentationBayesian defines no model(); benchmark it on the aleatoric ResNet,
+which returns (y_hat, sigma). Imported here so import errors are recorded per model """
+def _bayesian_resnet():
+    from .segmentation_bayesian import SegmentationBayesian
+    from .resnet import ResNet
+
+    class BayesianResNet(SegmentationBayesian, ResNet):
+        def __init__(self, **kwargs):
+            bayesian_resnet_defaults = {
+                'aleatoric': True,
+                'name': 'bayesian_resnet', }
+            bayesian_resnet_defaults.update(**kwargs)
+            super(BayesianResNet, self).__init__(**bayesian_resnet_defaults)
+
+    return BayesianResNet
+
+
+def _model_class(name, mode):
+    module, train_cls, test_cls = MODELS[name]
+    if module is None:
+        return globals()[train_cls if mode == 'TRAIN' else test_cls]()
+    module = importlib.import_module('.' + module, package=__package__)
+    return getattr(module, train_cls if mode == 'TRAIN' else test_cls)
+
+
+def _gflops(graph, run_meta):
+    opts = tf.profiler.ProfileOptionBuilder.float_operation()
+    opts['output'] = 'none'
+    prof = tf.profiler.profile(graph, run_meta=run_meta, cmd='op', options=opts)
+    return prof.total_float_ops / 1e9
+
+
+def benchmark_model(name, mode, x_dims, batch_size, n_classes=2, n_steps=10, warmup=2,
+    work_dir=None):
+    result = collections.OrderedDict([('model', name), ('mode', mode),
+        ('x_dims', 'x'.join(str(d) for d in x_dims)), ('batch_size', batch_size)])
+
+    tf.reset_default_graph()
+    sess = tf.Session()
+    try:
+        model_class = _model_class(name, mode)
+        kwargs = {'sess': sess, 'x_dims': x_dims, 'n_classes': n_classes, 'mode': mode}
+        if mode == 'TRAIN':
+            kwargs.update({'dataset': SyntheticSegmentationDataset(x_dims, n_classes, batch_size),
+                           'log_dir': work_dir, 'save_dir': work_dir})
+
+        tstart = time.time()
+        model = model_class(**kwargs)
+        result['build_s'] = time.time() - tstart
+
+        model._count_params()
+        result['params'] = int(model.pcount)
+
+        if mode == 'TRAIN':
+            fetches, feed_dict = model.train_op, None
+        else:
+            x = np.random.uniform(-1, 1, [batch_size] + list(x_dims)).astype(np.float32)
+            fetches, feed_dict = model.y_hat, {model.x_in: x, model.keep_prob: 1.0,
+                                               model.training: False}
+
+        run_meta = tf.RunMetadata()
+        sess.run(fetches, feed_dict=feed_dict, run_metadata=run_meta,
+            options=tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE))
+        result['gflops'] = _gflops(sess.graph, run_meta)
+
+        for _ in range(warmup):
+            sess.run(fetches, feed_dict=feed_dict)
+        latencies = []
+        for _ in range(n_steps):
+            tstart = time.time()
+            sess.run(fetches, feed_dict=feed_dict)
+            latencies.append(time.time() - tstart)
+
+        result['p50_ms'] = float(np.percentile(latencies, 50) * 1000.)
+        result['mean_ms'] = float(np.mean(latencies) * 1000.)
+        result['images_per_sec'] = batch_size / np.mean(latencies)
+    except Exception as e:
+        result['error'] = '{}: {}'.format(type(e).__name__, e)
+    finally:
+        sess.close()
+
+    return result
+
+
+""" Run every model x mode x x_dims x batch_size; write output.csv and output.json """
+def benchmark_models(models=None, modes=None, x_dims=None, batch_sizes=None, n_classes=2,
+    n_steps=10, warmup=2, output=None):
+    if models is None:
+        models = list(MODELS.keys())
+    if modes is None:
+        modes = ['TEST', 'TRAIN']
+    if x_dims is None:
+        x_dims = [[256, 256, 3]]
+    if batch_sizes is None:
+        batch_sizes = [1, 8]
+
+    work_dir = tempfile.mkdtemp(prefix='tfmodels_model_benchmark_')
+    results = []
+    try:
+        for name in models:
+            for mode in modes:
+                for dims in x_dims:
+                    for batch_size in batch_sizes:
+                        result = benchmark_model(name, mode, dims, batch_size,
+                            n_classes=n_classes, n_steps=n_steps, warmup=warmup,
+                            work_dir=work_dir)
+                        print(json.dumps(result))
+                        results.append(result)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if output is not None:
+        with open(output + '.csv', 'w') as f:
+            writer = csv.DictWriter(f, fieldnames=COLUMNS)
+            writer.writeheader()
+            for result in results:
+                writer.writerow(result)
+
+        report = collections.OrderedDict([
+            ('created', datetime.datetime.now().strftime("%Y_%m_%d_%H_%M_%S")),
+            ('tensorflow', tf.__version__),
+            ('python', platform.python_version()),
+            ('host', platform.node()),
+            ('results', results)])
+        with open(output + '.json', 'w') as f:
+            json.dump(report, f, indent=2)
+        print('Wrote {0}.csv and {0}.json'.format(output))
+
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmark segmentation architectures')
+    parser.add_argument('--models', nargs='+', default=list(MODELS.keys()))
+    parser.add_argument('--modes', nargs='+', default=['TEST', 'TRAIN'])
+    parser.add_argument('--sizes', nargs='+', type=int, default=[256],
+        help='square input sizes; 3 channels')
+    parser.add_argument('--batch_sizes', nargs='+', type=int, default=[1, 8])
+    parser.add_argument('--n_steps', type=int, default=10)
+    parser.add_argument('--output', default='model_benchmark')
+    args = parser.parse_args()
+
+    benchmark_models(models=args.models, modes=args.modes,
+        x_dims=[[size, size, 3] for size in args.sizes], batch_sizes=args.batch_sizes,
+        n_steps=args.n_steps, output=args.output)
@@ -168,13 +168,12 @@ class DenseNet(Segmentation):
     ## Overload to fill in the default keep_prob
     def train_step(self):
         self.global_step += 1
-        self.sess.run(self.seg_training_op_list, feed_dict={self.keep_prob: 0.5})
-
-        if self.global_step % self.summary_iters == 0:
-            self._write_scalar_summaries()
-
-        if self.global_step % self.summary_image_iters == 0:
-            self._write_image_summaries()
+        fetches = self._summary_fetches()
+        fetches['train'] = self.seg_training_op_list + self.input_fetches
+        fetched = self.profiler.run(self.sess, fetches, feed_dict={self.keep_prob: 0.5})
+        with self.profiler.phase('summaries'):
+            self._write_summaries(fetched)
+        self.profiler.end_step(self.global_step, getattr(self.dataset, 'batch_size', None))
 
 
 class DenseNetTraining(DenseNet):
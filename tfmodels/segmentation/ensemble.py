@@ -0,0 +1,117 @@
+from __future__ import print_function
+import tensorflow as tf
+import numpy as np
+
+from ..utilities.tiling import sliding_window_inference
+
+"""
+Several trained segmentation models over one shared input
+
+Each member is built in TEST mode on the ensemble's x_in (see the input_tensor
+option of Segmentation), so a batch is fed, or decoded from a dataset, once for
+the whole ensemble. Every member's softmax and their weighted average are
+fetched together in a single sess.run.
+
+    ensemble = SegmentationEnsemble(sess=sess, x_dims=[256, 256, 3], members=[
+        (DenseNetInference, {'n_classes': 4, 'name': 'densenet'}),
+        (ResNetInference, {'n_classes': 4, 'name': 'resnet'})])
+    ensemble.restore(['densenet/snapshots/densenet.ckpt-10000',
+                      'resnet/snapshots/resnet.ckpt-10000'])
+    y_hat = ensemble.inference(x)                 ## (n, h, w, 4) average
+    y_hats = ensemble.inference(x, average=False) ## one array per member
+
+Members build their graph under variable_scope(name), so names must be unique.
+Each member's saver is narrowed to its own variables so snapshots from single
+model training restore as usual.
+
+Pass input_tensor (e.g. a dataset's image_op) to build on that instead of a
+placeholder; it can still be overridden by feeding x_in.
+"""
+
+class SegmentationEnsemble(object):
+    def __init__(self, sess, members, x_dims=[256, 256, 3], weights=None,
+        input_tensor=None, name='ensemble'):
+        self.sess = sess
+        self.x_dims = x_dims
+        self.name = name
+
+        names = [kwargs.get('name') for _, kwargs in members]
+        assert None not in names, 'Give every ensemble member a name'
+        assert len(set(names)) == len(names), 'Ensemble member names must be unique'
+
+        if weights is None:
+            weights = [1.0] * len(members)
+        assert len(weights) == len(members)
+        self.weights = np.array(weights, dtype=np.float32) / np.sum(weights)
+
+        if input_tensor is None:
+            self.x_in = tf.placeholder('float',
+                shape=[None, self.x_dims[0], self.x_dims[1], self.x_dims[2]],
+                name='{}_x_in'.format(name))
+        else:
+            self.x_in = tf.placeholder_with_default(input_tensor,
+                shape=[None, self.x_dims[0], self.x_dims[1], self.x_dims[2]],
+                name='{}_x_in'.format(name))
+
+        self.members = []
+        for model_class, kwargs in members:
+            member_kwargs = {'sess': sess, 'x_dims': x_dims}
+            member_kwargs.update(**kwargs)
+            member_kwargs.update({'mode': 'TEST', 'input_tensor': self.x_in})
+            self.members.append(model_class(**member_kwargs))
+
+        ## Default savers hold every global variable in the graph, ie. all members
+        for member in self.members:
+            member_vars = [var for var in tf.global_variables()
+                           if var.op.name.startswith(member.name + '/')]
+            member.saver = tf.train.Saver(var_list=member_vars, max_to_keep=5)
+
+        with tf.name_scope(name):
+            self.y_hat_smax_list = [member.y_hat_smax for member in self.members]
+            self.y_hat_smax = tf.add_n([w * y_hat for w, y_hat in
+                zip(self.weights, self.y_hat_smax_list)], name='y_hat_smax')
+
+        print('Ensemble {}: {}'.format(name, ', '.join(names)))
+
+
+    def restore(self, snapshot_paths):
+        assert len(snapshot_paths) == len(self.members)
+        for member, snapshot_path in zip(self.members, snapshot_paths):
+            member.restore(snapshot_path)
+
+
+    def _feed_dict(self, x_in, keep_prob=1.0):
+        feed_dict = {} if x_in is None else {self.x_in: x_in}
+        for member in self.members:
+            feed_dict[member.keep_prob] = keep_prob
+            feed_dict[member.training] = False
+        return feed_dict
+
+
+    """ x_in=None pulls the batch from input_tensor """
+    def inference(self, x_in=None, keep_prob=1.0, average=True):
+        fetches = self.y_hat_smax if average else self.y_hat_smax_list
+        return self.sess.run(fetches, feed_dict=self._feed_dict(x_in, keep_prob))
+
+
+    """ Fetch the average and every member's softmax from the same run """
+    def inference_all(self, x_in=None, keep_prob=1.0):
+        return self.sess.run([self.y_hat_smax, self.y_hat_smax_list],
+            feed_dict=self._feed_dict(x_in, keep_prob))
+
+
+    def sliding_window_inference(self, image, stride=None, batch_size=8, blend='gaussian',
+        keep_prob=1.0, preprocess_fn=None, foreground=None, out=None):
+        predict_fn = lambda x_in: self.inference(x_in, keep_prob=keep_prob)
+        return sliding_window_inference(predict_fn, image, tile_size=self.x_dims[:2],
+            n_outputs=self.y_hat_smax.get_shape().as_list()[-1], stride=stride,
+            batch_size=batch_size, blend=blend, preprocess_fn=preprocess_fn,
+            foreground=foreground, out=out)
+
+
+    def print_info(self):
+        print('------------------------ {} ---------------------- '.format(self.name))
+        for member, weight in zip(self.members, self.weights):
+            print('|\t\t {}: {} (weight {:3.3f})'.format(member.name,
+                type(member).__name__, weight))
+        print('------------------------ {} ---------------------- '.format(self.name))
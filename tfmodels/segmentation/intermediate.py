@@ -1,6 +1,6 @@
 from __future__ import print_function
 import tensorflow as tf
-from .segmentation_basemodel import SegmentationBaseModel
+from .segmentation_basemodel import Segmentation
 from ..utilities.ops import *
 
 
@@ -10,7 +10,7 @@ Fully Convolutional DenseNet: https://arxiv.org/abs/1611.09326
 
 Implementation is loosely based on the above papers.
 """
-class IntermediateNet(SegmentationBaseModel):
+class IntermediateNet(Segmentation):
 
     def __init__(self, **kwargs):
         base_defaults={
@@ -4,6 +4,7 @@ import numpy as np
 import sys, os
 
 from ..utilities.basemodel import BaseModel
+from ..utilities.tiling import sliding_window_inference
 
 class Regression(BaseModel):
     def __init__(self, **kwargs):
@@ -186,15 +187,34 @@ class Regression(BaseModel):
                  self.y_in_sum_test, self.y_hat_sum_test])
 
 
-    def _write_scalar_summaries(self):
-        summary_str, reg_loss_ = self.sess.run([self.summary_scalars_op, self.reg_loss])
+    """ Summary fetches due at the current global_step, run with the training step """
+    def _summary_fetches(self):
+        fetches = {}
+        if self.global_step % self.summary_iters == 0:
+            fetches['scalars'] = [self.summary_scalars_op, self.reg_loss]
+        if self.global_step % self.summary_image_iters == 0:
+            fetches['images'] = self.summary_images_op
+        return fetches
+
+
+    def _write_summaries(self, fetched):
+        if 'scalars' in fetched:
+            self._write_scalar_summaries(*fetched['scalars'])
+        if 'images' in fetched:
+            self._write_image_summaries(fetched['images'])
+
+
+    def _write_scalar_summaries(self, summary_str=None, reg_loss_=None):
+        if summary_str is None:
+            summary_str, reg_loss_ = self.sess.run([self.summary_scalars_op, self.reg_loss])
         self.summary_writer.add_summary(summary_str, self.global_step)
         print('[{:07d}] writing scalar summaries (loss={:3.3f})'.format(self.global_step, reg_loss_))
 
 
-    def _write_image_summaries(self):
+    def _write_image_summaries(self, summary_str=None):
         print('[{:07d}] writing image summaries'.format(self.global_step))
-        summary_str = self.sess.run(self.summary_images_op)
+        if summary_str is None:
+            summary_str = self.sess.run(self.summary_images_op)
         self.summary_writer.add_summary(summary_str, self.global_step)
 
 
@@ -218,6 +238,25 @@ class Regression(BaseModel):
         return y_hat_
 
 
+    """ Whole-image inference for inputs larger than x_dims
+
+    Same as Segmentation.sliding_window_inference; overlapping regression
+    outputs are blended instead of the softmax.
+    """
+    def sliding_window_inference(self, image, stride=None, batch_size=8, blend='gaussian',
+        keep_prob=1.0, preprocess_fn=None, foreground=None, out=None):
+        def predict_fn(x_in):
+            feed_dict = {self.x_in: x_in,
+                         self.keep_prob: keep_prob,
+                         self.training: False}
+            return self.sess.run(self.y_hat, feed_dict=feed_dict)
+
+        return sliding_window_inference(predict_fn, image, tile_size=self.x_dims[:2],
+            n_outputs=self.y_hat.get_shape().as_list()[-1], stride=stride,
+            batch_size=batch_size, blend=blend, preprocess_fn=preprocess_fn,
+            foreground=foreground, out=out)
+
+
     def model(self, x_hat, keep_prob=0.5, reuse=True, training=True):
         raise Exception(NotImplementedError)
 
@@ -231,13 +270,12 @@ class Regression(BaseModel):
 
     def train_step(self):
         self.global_step += 1
-        self.sess.run(self.reg_training_op_list)
-
-        if self.global_step % self.summary_iters == 0:
-            self._write_scalar_summaries()
-
-        if self.global_step % self.summary_image_iters == 0:
-            self._write_image_summaries()
+        fetches = self._summary_fetches()
+        fetches['train'] = self.reg_training_op_list
+        fetched = self.profiler.run(self.sess, fetches)
+        with self.profiler.phase('summaries'):
+            self._write_summaries(fetched)
+        self.profiler.end_step(self.global_step, getattr(self.dataset, 'batch_size', None))
 
     """ Run a number of testing iterations """
     def test(self):
@@ -230,17 +230,13 @@ class SegmentationAdversarial(Segmentation):
         print('Pretraining Generator without adversary for {} iterations'.format(self.pretrain_g))
         for _ in xrange(self.pretrain_g):
             self.global_step += 1
-            self.sess.run([self.seg_training_op])
-            if self.global_step % self.summary_iters == 0:
-                self._write_scalar_summaries()
-            if self.global_step % self.summary_image_iters == 0:
-                self._write_scalar_summaries()
+            fetches = self._summary_fetches()
+            fetches['train'] = [self.seg_training_op] + self.input_fetches
+            self._write_summaries(self.sess.run(fetches))
 
         print('Pretraining Discriminator for {} iterations'.format(self.pretrain_d))
         for _ in xrange(self.pretrain_d):
             self.global_step += 1
-            self.sess.run(self.discriminator.discriminator_train_op_list)
-            if self.global_step % self.summary_iters == 0:
-                self._write_scalar_summaries()
-            if self.global_step % self.summary_image_iters == 0:
-                self._write_scalar_summaries()
+            fetches = self._summary_fetches()
+            fetches['train'] = self.discriminator.discriminator_train_op_list + self.input_fetches
+            self._write_summaries(self.sess.run(fetches))
@@ -5,6 +5,9 @@ import numpy as np
 import sys, os
 
 from ..utilities.basemodel import BaseModel
+from ..utilities.tiling import sliding_window_inference
+from ..utilities.staging import DeviceStager
+from ..utilities.tta import dihedral_transforms, tta_views, tta_invert
 
 class Segmentation(BaseModel):
 
@@ -13,7 +16,9 @@ class Segmentation(BaseModel):
         segmentation_defaults={
             'class_weights': None, ## https://arxiv.org/abs/1511.00561
             'dataset': None,
+            'full_test': False, ## test() makes one pass over the whole test set via evaluate()
             'global_step': 0,
+            'input_tensor': None, ## TEST mode: build on this tensor instead of a new placeholder
             'k_size': 3,
             'learning_rate': 1e-3,
             'log_dir': None,
@@ -25,6 +30,9 @@ class Segmentation(BaseModel):
             'save_dir': None,
             'sess': None,
             'seg_training_op_list': [],
+            'stage_capacity': 2,
+            'stage_device': None,
+            'stage_inputs': False, ## Double-buffer dataset batches onto stage_device
             'summarize_grads': False,
             'summary_iters': 50,
             'summary_image_iters': 250,
@@ -86,6 +94,8 @@ class Segmentation(BaseModel):
         ## ------------------- TensorFlow helpers ------------------- ##
         self._tf_ops()
         self.sess.run(tf.global_variables_initializer())
+        if self.stage_inputs:
+            self.stager.prime(self.sess)
 
         self._print_info_to_file(filename=os.path.join(self.save_dir,
             '{}_settings.txt'.format(self.name)))
@@ -95,9 +105,15 @@ class Segmentation(BaseModel):
     def _test_mode(self):
         print('Setting up {} in inference mode'.format(self.name))
         ## ------------------- Input ops ------------------- ##
-        self.x_in = tf.placeholder('float',
-            shape=[None, self.x_dims[0], self.x_dims[1], self.x_dims[2]],
-            name='x_in')
+        ## An input_tensor lets several models share one decoded input (see ensemble.py)
+        if self.input_tensor is not None:
+            self.x_in = tf.placeholder_with_default(self.input_tensor,
+                shape=[None, self.x_dims[0], self.x_dims[1], self.x_dims[2]],
+                name='x_in')
+        else:
+            self.x_in = tf.placeholder('float',
+                shape=[None, self.x_dims[0], self.x_dims[1], self.x_dims[2]],
+                name='x_in')
 
         ## ------------------- Model ops ------------------- ##
         # self.keep_prob = tf.placeholder('float', name='keep_prob')
@@ -113,24 +129,54 @@ class Segmentation(BaseModel):
         return [var for var in t_vars if self.name in var.name]
 
 
-    def _class_weighted_loss(self):
+    def _class_weighted_loss(self, y_in=None, y_hat=None):
+        if y_in is None:
+            y_in = self.y_in
+        if y_hat is None:
+            y_hat = self.y_hat
         ## https://github.com/tensorflow/tensorflow/issues/10021
-        sample_weights = tf.reduce_sum(tf.multiply(self.y_in, self.class_weights), -1)
+        sample_weights = tf.reduce_sum(tf.multiply(y_in, self.class_weights), -1)
         print('\t segmentation losses sample_weights:', sample_weights)
-        seg_loss = tf.losses.softmax_cross_entropy(onehot_labels=self.y_in,
-            logits=self.y_hat, weights=sample_weights)
+        seg_loss = tf.losses.softmax_cross_entropy(onehot_labels=y_in,
+            logits=y_hat, weights=sample_weights)
         print('\t segmentation losses seg_loss:', seg_loss)
         return seg_loss
 
 
+    """ With stage_inputs, batches pass through a DeviceStager and every run that
+    pulls from the dataset also fetches self.input_fetches to stage the next batch """
     def _make_input_ops(self):
-        self.x_in = tf.placeholder_with_default(self.dataset.image_op,
+        if self.stage_inputs:
+            self.stager = DeviceStager(self.dataset, device=self.stage_device,
+                capacity=self.stage_capacity, name='{}_stager'.format(self.name))
+            image_op, mask_op = self.stager.image_op, self.stager.mask_op
+            self.input_fetches = [self.stager.put_op]
+        else:
+            image_op, mask_op = self.dataset.image_op, self.dataset.mask_op
+            self.input_fetches = []
+
+        self.x_in = tf.placeholder_with_default(image_op,
             shape=[None, self.x_dims[0], self.x_dims[1], self.x_dims[2]],
             name='x_in')
-        self.y_in = tf.placeholder_with_default(self.dataset.mask_op,
+        self.y_in = tf.placeholder_with_default(mask_op,
             shape=[None, self.x_dims[0], self.x_dims[1], self.n_classes], name='y_in')
 
 
+    """ Switch the dataset to phase 'TRAIN' or 'TEST', restaging if needed. TFRecord
+    datasets keep both iterators alive, so only staged batches are dropped """
+    def _switch_dataset(self, phase):
+        if self.stage_inputs:
+            self.stager.clear(self.sess)
+
+        if phase == 'TEST':
+            self.dataset._initalize_testing(self.sess)
+        else:
+            self.dataset._initalize_training(self.sess)
+
+        if self.stage_inputs:
+            self.stager.prime(self.sess)
+
+
     def _make_model_ops(self, keep_prob=0.5, training=True):
         self.keep_prob = tf.placeholder_with_default(keep_prob, shape=[], name='keep_prob')
         self.training = tf.placeholder_with_default(training, shape=())
@@ -143,18 +189,25 @@ class Segmentation(BaseModel):
         print('Model output y_hat:', self.y_hat.get_shape())
 
 
+    """ Segmentation loss of logits y_hat against one-hot y_in. Subclasses with
+    other losses override this (see SegmentationBayesian); sigma is passed along
+    for models that return (y_hat, sigma) """
+    def _segmentation_loss(self, y_in, y_hat, sigma=None):
+        if self.class_weights:
+            return self._class_weighted_loss(y_in, y_hat)
+        else:
+            return tf.reduce_mean(tf.nn.softmax_cross_entropy_with_logits_v2(
+                labels=y_in, logits=y_hat))
+
+
     ## define self.seg_loss
     def _make_segmentation_loss(self, target_op=None):
         ## Default target
         if target_op is None:
             target_op = self.y_hat
 
-        if self.class_weights:
-            self.seg_loss = self._class_weighted_loss()
-        else:
-            self.seg_loss = tf.nn.softmax_cross_entropy_with_logits_v2(
-                labels=self.y_in, logits=target_op)
-            self.seg_loss = tf.reduce_mean(self.seg_loss)
+        self.seg_loss = self._segmentation_loss(self.y_in, target_op,
+            getattr(self, 'sigma', None))
 
 
     def _make_training_ops(self):
@@ -233,54 +286,242 @@ class Segmentation(BaseModel):
                 [self.loss_sum_test, self.x_in_sum_test,
                  self.y_in_sum_test, self.y_hat_sum_test])
 
-    def _write_scalar_summaries(self, lr=None):
-        if lr is None: lr='constant'
-        summary_str, seg_loss_ = self.sess.run([self.summary_scalars_op, self.seg_loss])
+    """ Summary fetches due at the current global_step. Add these to the step's
+    training sess.run so the summaries describe the batch being trained on. """
+    def _summary_fetches(self):
+        fetches = {}
+        if self.global_step % self.summary_iters == 0:
+            fetches['scalars'] = [self.summary_scalars_op, self.seg_loss]
+        if self.global_step % self.summary_image_iters == 0:
+            fetches['images'] = self.summary_images_op
+        return fetches
+
+
+    def _write_summaries(self, fetched):
+        if 'scalars' in fetched:
+            self._write_scalar_summaries(*fetched['scalars'])
+        if 'images' in fetched:
+            self._write_image_summaries(fetched['images'])
+
+
+    """ Pass values fetched with the training step; without them the summaries are
+    computed with a separate sess.run on a new batch """
+    def _write_scalar_summaries(self, summary_str=None, seg_loss_=None, lr=None):
+        lr = 'constant' if lr is None else '{:03E}'.format(lr)
+        if summary_str is None:
+            summary_str, seg_loss_ = self.sess.run([self.summary_scalars_op, self.seg_loss]
+                + self.input_fetches)[:2]
         self.summary_writer.add_summary(summary_str, self.global_step)
-        print('[{:07d}] writing scalar summaries (loss={:3.3f}) (lr={:03E})'.format(self.global_step, seg_loss_, lr))
+        print('[{:07d}] writing scalar summaries (loss={:3.3f}) (lr={})'.format(self.global_step, seg_loss_, lr))
 
 
-    def _write_image_summaries(self):
+    def _write_image_summaries(self, summary_str=None):
         print('[{:07d}] writing image summaries'.format(self.global_step))
-        summary_str = self.sess.run(self.summary_images_op)
+        if summary_str is None:
+            summary_str = self.sess.run([self.summary_images_op] + self.input_fetches)[0]
         self.summary_writer.add_summary(summary_str, self.global_step)
 
 
     ## ------------------- Callable functions --------------------- ##
 
-    def inference(self, x_in, keep_prob=1.0):
+    """ With tta=True each image is scored as its 8 flips / 90 degree rotations
+    (4 flips if x_dims is not square) in one batch, and the softmax of every view
+    is mapped back and averaged in-graph. See utilities/tta.py """
+    def inference(self, x_in, keep_prob=1.0, tta=False):
+        if tta:
+            if not hasattr(self, 'x_tta'):
+                self._make_tta_ops()
+            feed_dict = {self.x_tta: x_in,
+                         self.keep_prob: keep_prob,
+                         self.training: False}
+            return self.sess.run(self.y_tta_smax, feed_dict=feed_dict)
+
         feed_dict = {self.x_in: x_in,
                      self.keep_prob: keep_prob,
                      self.training: False}
         y_hat_ = self.sess.run(self.y_hat_smax, feed_dict=feed_dict)
         return y_hat_
 
+
+    """ Input placeholder for TTA and its views, stacked along the batch axis """
+    def _make_tta_views(self):
+        self.x_tta = tf.placeholder('float',
+            shape=[None, self.x_dims[0], self.x_dims[1], self.x_dims[2]],
+            name='x_tta')
+        self.tta_transforms = dihedral_transforms(square=self.x_dims[0] == self.x_dims[1])
+        return tta_views(self.x_tta, self.tta_transforms)
+
+
+    """ Second forward branch over the TTA views, sharing the model variables """
+    def _make_tta_ops(self):
+        x_views = self._make_tta_views()
+        y_hat = self.model(x_views, keep_prob=self.keep_prob, reuse=True,
+            training=self.training)
+        self.y_tta_views = tta_invert(tf.nn.softmax(y_hat), self.tta_transforms)
+        self.y_tta_smax = tf.reduce_mean(self.y_tta_views, axis=0)
+
+    """ Whole-image inference for inputs larger than x_dims
+
+    image is (h, w, c) and may be any array supporting slicing (e.g. np.memmap).
+    Overlapping tiles with the model's input size are cut every `stride` pixels,
+    run through the graph `batch_size` at a time and the softmax is blended back
+    together. Pass a tissue mask as `foreground` to skip background tiles.
+    See utilities/tiling.py
+    """
+    def sliding_window_inference(self, image, stride=None, batch_size=8, blend='gaussian',
+        keep_prob=1.0, preprocess_fn=None, foreground=None, out=None, tta=False):
+        def predict_fn(x_in):
+            ## SegmentationBayesian.inference returns (y_hat, sigma)
+            return Segmentation.inference(self, x_in, keep_prob=keep_prob, tta=tta)
+
+        return sliding_window_inference(predict_fn, image, tile_size=self.x_dims[:2],
+            n_outputs=self.y_hat_smax.get_shape().as_list()[-1], stride=stride,
+            batch_size=batch_size, blend=blend, preprocess_fn=preprocess_fn,
+            foreground=foreground, out=out)
+
     def model(self, x_hat, keep_prob=0.5, reuse=True, training=True):
         raise Exception(NotImplementedError)
 
     def test_step(self, step_delta, keep_prob=1.0):
         fd = {self.keep_prob: keep_prob,
               self.training: False}
-        summary_str, test_loss_ = self.sess.run([self.summary_test_ops, self.loss], feed_dict=fd)
+        summary_str, test_loss_ = self.sess.run([self.summary_test_ops, self.loss]
+            + self.input_fetches, feed_dict=fd)[:2]
         # self.summary_writer.add_summary(summary_str, self.global_step+step_delta)
         print('#### TEST #### [{:07d}] writing test summaries (loss={:3.3f})'.format(self.global_step, test_loss_))
         return test_loss_, summary_str
 
     def train_step(self):
         self.global_step += 1
-        self.sess.run(self.seg_training_op_list)
-
-        if self.global_step % self.summary_iters == 0:
-            self._write_scalar_summaries()
-
-        if self.global_step % self.summary_image_iters == 0:
-            self._write_image_summaries()
+        fetches = self._summary_fetches()
+        fetches['train'] = self.seg_training_op_list + self.input_fetches
+        fetched = self.profiler.run(self.sess, fetches)
+        with self.profiler.phase('summaries'):
+            self._write_summaries(fetched)
+        self.profiler.end_step(self.global_step, getattr(self.dataset, 'batch_size', None))
+
+
+    """ Build a tf.while_loop running n_steps optimizer updates in one sess.run
+
+    Each iteration pulls its own batch from dataset.iterator and rebuilds the forward
+    pass with reuse=True; the optimizer's slots are shared with train_op. The last
+    iteration's loss, scalars (see _loop_scalars), inputs and prediction are carried
+    out of the loop so summaries need no extra forward pass. Staged inputs
+    (stage_inputs) are bypassed here.
+
+    Loop summaries are kept out of the default collection so merge_all() in
+    _make_summaries never picks up tensors from inside the loop.
+    """
+    def _make_loop_ops(self):
+        self.n_steps = tf.placeholder(tf.int32, shape=[], name='n_steps')
+        x_shape = [None, self.x_dims[0], self.x_dims[1], self.x_dims[2]]
+        y_shape = [None, self.x_dims[0], self.x_dims[1], self.n_classes]
+        scalar_names = []
+
+        def body(step, loss, scalars_last, x_last, y_last, y_hat_last):
+            x_in, y_in = self.dataset.iterator.get_next()
+            x_in.set_shape(x_shape)
+            y_in.set_shape(y_shape)
+
+            update_ops = set(tf.get_collection(tf.GraphKeys.UPDATE_OPS))
+            y_hat = self.model(x_in, keep_prob=self.keep_prob, reuse=True, training=True)
+            update_ops = [op for op in tf.get_collection(tf.GraphKeys.UPDATE_OPS)
+                          if op not in update_ops]
+
+            sigma = None
+            if isinstance(y_hat, (list, tuple)):
+                ## Aleatoric models return (y_hat, sigma)
+                y_hat, sigma = y_hat
+            loss = self._segmentation_loss(y_in, y_hat, sigma)
+
+            ## The body is traced once; keep the names to unpack the scalars after the loop
+            scalars = self._loop_scalars(y_in, y_hat, sigma, loss)
+            del scalar_names[:]
+            scalar_names.extend(name for name, _ in scalars)
+            scalars = tf.stack([tf.cast(val, tf.float32) for _, val in scalars])
+
+            with tf.control_dependencies(update_ops):
+                train_op = self.optimizer.minimize(loss, var_list=self.var_list)
+
+            with tf.control_dependencies([train_op]):
+                return (step + 1, tf.identity(loss), tf.identity(scalars),
+                        tf.identity(x_in), tf.identity(y_in), tf.identity(y_hat))
+
+        with tf.name_scope('train_steps'):
+            loop_vars = [tf.constant(0), tf.constant(0.0), tf.zeros([0]),
+                         tf.zeros([0] + x_shape[1:]), tf.zeros([0] + y_shape[1:]),
+                         tf.zeros([0] + y_shape[1:])]
+            invariants = [tf.TensorShape([]), tf.TensorShape([]), tf.TensorShape([None]),
+                          tf.TensorShape(x_shape), tf.TensorShape(y_shape),
+                          tf.TensorShape(y_shape)]
+            _, self.loop_loss, loop_scalars, loop_x, loop_y, loop_y_hat = tf.while_loop(
+                lambda step, *args: step < self.n_steps, body, loop_vars,
+                shape_invariants=invariants, back_prop=False)
+
+            loop_scalars = tf.unstack(loop_scalars, num=len(scalar_names))
+            self.loop_scalars_op = tf.summary.merge(
+                [tf.summary.scalar(name, val, collections=[])
+                 for name, val in zip(scalar_names, loop_scalars)])
+
+            y_in_mask = tf.expand_dims(tf.cast(tf.argmax(loop_y, axis=-1), tf.float32), -1)
+            y_hat_mask = tf.expand_dims(tf.cast(tf.argmax(loop_y_hat, axis=-1), tf.float32), -1)
+            self.loop_images_op = tf.summary.merge([
+                tf.summary.image('x_in', loop_x, max_outputs=self.summary_image_n,
+                    collections=[]),
+                tf.summary.image('y_in', y_in_mask, max_outputs=self.summary_image_n,
+                    collections=[]),
+                tf.summary.image('y_hat', y_hat_mask, max_outputs=self.summary_image_n,
+                    collections=[])])
+
+
+    """ (name, scalar) pairs summarized from the last train_steps iteration. Names
+    follow the scalars in summary_scalars_op; subclasses append their own """
+    def _loop_scalars(self, y_in, y_hat, sigma, loss):
+        return [('seg_loss', loss), ('loss', loss)]
+
+
+    """ Run n_steps training iterations inside the graph with one sess.run
+
+    Scalar and image summaries are written from the final iteration whenever
+    the step count crosses summary_iters or summary_image_iters.
+    """
+    def train_steps(self, n_steps, keep_prob=0.5):
+        if not hasattr(self, 'loop_loss'):
+            self._make_loop_ops()
+
+        prev_step = self.global_step
+        self.global_step += n_steps
+        fetches = {'loss': self.loop_loss}
+        if self.global_step // self.summary_iters > prev_step // self.summary_iters:
+            fetches['scalars'] = self.loop_scalars_op
+        if self.global_step // self.summary_image_iters > prev_step // self.summary_image_iters:
+            fetches['images'] = self.loop_images_op
+
+        fd = {self.n_steps: n_steps, self.keep_prob: keep_prob}
+        fetched = self.profiler.run(self.sess, fetches, feed_dict=fd)
+
+        with self.profiler.phase('summaries'):
+            if 'scalars' in fetched:
+                self.summary_writer.add_summary(fetched['scalars'], self.global_step)
+                print('[{:07d}] writing scalar summaries (loss={:3.3f})'.format(
+                    self.global_step, fetched['loss']))
+            if 'images' in fetched:
+                print('[{:07d}] writing image summaries'.format(self.global_step))
+                self.summary_writer.add_summary(fetched['images'], self.global_step)
+
+        batch_size = getattr(self.dataset, 'batch_size', None)
+        self.profiler.end_step(self.global_step,
+            None if batch_size is None else batch_size * n_steps)
+        return fetched['loss']
 
 
     """ Run a number of testing iterations """
     def test(self, keep_prob=1.0):
+        if self.full_test:
+            return self.evaluate()
+
         ## Switch dataset to testing
-        self.dataset._initalize_testing(self.sess)
+        self._switch_dataset('TEST')
 
         test_losses = []
         for step_delta in xrange(self.n_test_batches):
@@ -291,4 +532,101 @@ class Segmentation(BaseModel):
         print('\n#### MEAN TEST LOSS = {:3.5f} +/- {:3.6f} #####\n'.format(loss_mean, loss_std))
 
         self.summary_writer.add_summary(summary_str, self.global_step)
-        self.dataset._initalize_training(self.sess)
+        self._switch_dataset('TRAIN')
+
+
+    """ Streaming evaluation over dataset.eval_iterator
+
+    A forward branch with keep_prob=1.0 and training=False reads the one-pass eval
+    pipeline. Each run adds the batch's confusion matrix, summed per-pixel loss and
+    pixel count to local variables, so a final partial batch is weighted by its size.
+    IoU, Dice and pixel accuracy are derived from the confusion matrix in-graph.
+    Classes absent from both labels and predictions get NaN IoU and Dice and are left
+    out of the means. Rows of the confusion matrix are labels, columns predictions.
+    """
+    def _make_eval_ops(self):
+        x_in, y_in = self.dataset.eval_image_op, self.dataset.eval_mask_op
+        x_in.set_shape([None, self.x_dims[0], self.x_dims[1], self.x_dims[2]])
+        y_in.set_shape([None, self.x_dims[0], self.x_dims[1], self.n_classes])
+
+        y_hat = self.model(x_in, keep_prob=1.0, reuse=True, training=False)
+        if isinstance(y_hat, (list, tuple)):
+            ## SegmentationBayesian returns (y_hat, sigma)
+            y_hat = y_hat[0]
+
+        with tf.variable_scope('{}_eval'.format(self.name)):
+            local = [tf.GraphKeys.LOCAL_VARIABLES]
+            confusion = tf.Variable(tf.zeros([self.n_classes, self.n_classes], dtype=tf.int64),
+                trainable=False, collections=local, name='confusion_matrix')
+            loss_sum = tf.Variable(0.0, dtype=tf.float64, trainable=False, collections=local,
+                name='loss_sum')
+            n_pixels = tf.Variable(0.0, dtype=tf.float64, trainable=False, collections=local,
+                name='n_pixels')
+            self.eval_reset_op = tf.variables_initializer([confusion, loss_sum, n_pixels])
+
+            labels = tf.reshape(tf.argmax(y_in, axis=-1), [-1])
+            predictions = tf.reshape(tf.argmax(y_hat, axis=-1), [-1])
+            batch_confusion = tf.confusion_matrix(labels, predictions,
+                num_classes=self.n_classes, dtype=tf.int64)
+            pixel_loss = tf.nn.softmax_cross_entropy_with_logits_v2(labels=y_in, logits=y_hat)
+            self.eval_update_op = tf.group(
+                tf.assign_add(confusion, batch_confusion),
+                tf.assign_add(loss_sum, tf.cast(tf.reduce_sum(pixel_loss), tf.float64)),
+                tf.assign_add(n_pixels, tf.cast(tf.size(pixel_loss), tf.float64)))
+
+            cm = tf.cast(confusion, tf.float64)
+            true_pos = tf.diag_part(cm)
+            label_count = tf.reduce_sum(cm, axis=1)
+            pred_count = tf.reduce_sum(cm, axis=0)
+            absent = tf.constant([np.nan] * self.n_classes, dtype=tf.float64)
+            def safe_ratio(num, denom):
+                return tf.where(denom > 0, num / tf.maximum(denom, 1.0), absent)
+            self.eval_metrics = {
+                'confusion_matrix': confusion,
+                'loss': loss_sum / tf.maximum(n_pixels, 1.0),
+                'pixel_accuracy': tf.reduce_sum(true_pos) / tf.maximum(tf.reduce_sum(cm), 1.0),
+                'iou': safe_ratio(true_pos, label_count + pred_count - true_pos),
+                'dice': safe_ratio(2 * true_pos, label_count + pred_count),
+            }
+
+
+    """ One deterministic pass over the whole test set; returns a dict with the
+    confusion matrix, mean loss, pixel accuracy and per-class IoU and Dice.
+    Scalars are written to the summary writer under eval/ """
+    def evaluate(self):
+        assert getattr(self.dataset, 'eval_iterator', None) is not None, \
+            'Dataset has no eval pipeline; give it a testing_record'
+        if not hasattr(self, 'eval_update_op'):
+            self._make_eval_ops()
+
+        self.sess.run(self.eval_reset_op)
+        self.dataset._initalize_eval(self.sess)
+        n_batches = 0
+        while True:
+            try:
+                self.sess.run(self.eval_update_op)
+                n_batches += 1
+            except tf.errors.OutOfRangeError:
+                break
+
+        metrics = self.sess.run(self.eval_metrics)
+        metrics['n_batches'] = n_batches
+        print('\n#### EVAL [{:07d}] {} batches: loss={:3.5f} pixel_accuracy={:3.5f} mIoU={:3.5f} mDice={:3.5f} ####'.format(
+            self.global_step, n_batches, metrics['loss'], metrics['pixel_accuracy'],
+            np.nanmean(metrics['iou']), np.nanmean(metrics['dice'])))
+        print('per-class IoU: ', ' '.join(['{:3.4f}'.format(v) for v in metrics['iou']]))
+        print('per-class Dice:', ' '.join(['{:3.4f}'.format(v) for v in metrics['dice']]), '\n')
+
+        if getattr(self, 'summary_writer', None) is not None:
+            values = [tf.Summary.Value(tag='eval/loss', simple_value=metrics['loss']),
+                      tf.Summary.Value(tag='eval/pixel_accuracy', simple_value=metrics['pixel_accuracy']),
+                      tf.Summary.Value(tag='eval/mean_iou', simple_value=np.nanmean(metrics['iou'])),
+                      tf.Summary.Value(tag='eval/mean_dice', simple_value=np.nanmean(metrics['dice']))]
+            for k in range(self.n_classes):
+                if np.isnan(metrics['iou'][k]):
+                    continue
+                values.append(tf.Summary.Value(tag='eval/iou_{}'.format(k), simple_value=metrics['iou'][k]))
+                values.append(tf.Summary.Value(tag='eval/dice_{}'.format(k), simple_value=metrics['dice'][k]))
+            self.summary_writer.add_summary(tf.Summary(value=values), self.global_step)
+
+        return metrics
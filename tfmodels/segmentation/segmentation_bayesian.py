@@ -5,6 +5,8 @@ import numpy as np
 import sys, os
 
 from segmentation_basemodel import Segmentation
+from ..utilities.stats import RunningMoments
+from ..utilities.tta import tta_invert
 
 class SegmentationBayesian(Segmentation):
 
@@ -20,6 +22,7 @@ class SegmentationBayesian(Segmentation):
             'k_size': 3,
             'learning_rate': 1e-3,
             'log_dir': None,
+            'mc_batch_size': 16, ## Max images per sess.run in bayesian_inference
             'mode': 'TRAIN',
             'name': 'Segmentation',
             'n_classes': None,
@@ -36,14 +39,6 @@ class SegmentationBayesian(Segmentation):
         super(SegmentationBayesian, self).__init__(**bayesian_segmentation_defaults)
 
 
-    def _make_input_ops(self):
-        self.x_in = tf.placeholder_with_default(self.dataset.image_op,
-            shape=[None, self.x_dims[0], self.x_dims[1], self.x_dims[2]],
-            name='x_in')
-        self.y_in = tf.placeholder_with_default(self.dataset.mask_op,
-            shape=[None, self.x_dims[0], self.x_dims[1], self.n_classes], name='y_in')
-
-
     def _make_model_ops(self, keep_prob=0.5, training=True):
         self.keep_prob = tf.placeholder_with_default(keep_prob, shape=[], name='keep_prob')
         self.training = tf.placeholder_with_default(training, shape=())
@@ -58,17 +53,29 @@ class SegmentationBayesian(Segmentation):
     def _heteroscedastic_aleatoric_loss(self):
         assert self.sigma is not None, 'Model does not have attribute sigma. Define sigma in model()'
 
-        print('Setting up heteroscedastic aleatoric loss:')
         ## Make a summary for sigma
         self.sigma_summary = tf.summary.scalar('sigma_mean', tf.reduce_mean(self.sigma))
         self.summary_op_list.append(self.sigma_summary)
 
+        self.seg_loss = self._segmentation_loss(self.y_in, self.y_hat, self.sigma)
+
+
+    def _loop_scalars(self, y_in, y_hat, sigma, loss):
+        scalars = super(SegmentationBayesian, self)._loop_scalars(y_in, y_hat, sigma, loss)
+        return scalars + [('sigma_mean', tf.reduce_mean(sigma))]
+
+
+    """ Heteroscedastic aleatoric loss; also used by train_steps() """
+    def _segmentation_loss(self, y_in, y_hat, sigma=None):
+        assert sigma is not None, 'Model does not return sigma. Define sigma in model()'
+
+        print('Setting up heteroscedastic aleatoric loss:')
         with tf.variable_scope('aleatoric') as scope:
             ## (batch_size, h*w, n_classes)
-            sigma_v = tf.reshape(self.sigma, [-1, np.prod(self.x_dims[:2]), 1])
+            sigma_v = tf.reshape(sigma, [-1, np.prod(self.x_dims[:2]), 1])
             dist = tf.distributions.Normal(loc=0.0, scale=sigma_v, name='dist')
-            y_hat_v = tf.reshape(self.y_hat, [-1, np.prod(self.x_dims[:2]), self.n_classes])
-            y_in_v = tf.reshape(self.y_in, [-1, np.prod(self.x_dims[:2]), self.n_classes])
+            y_hat_v = tf.reshape(y_hat, [-1, np.prod(self.x_dims[:2]), self.n_classes])
+            y_in_v = tf.reshape(y_in, [-1, np.prod(self.x_dims[:2]), self.n_classes])
 
             print('\t sigma_v', sigma_v.get_shape())
             print('\t y_hat_v', y_hat_v.get_shape())
@@ -111,7 +118,7 @@ class SegmentationBayesian(Segmentation):
             # loss = tf.reduce_mean(loss, axis=-1)
 
             ## Average over batch, pixels and T
-            self.seg_loss = tf.reduce_mean(losses)
+            return tf.reduce_mean(losses)
 
 
     def _make_training_ops(self):
@@ -199,7 +206,11 @@ class SegmentationBayesian(Segmentation):
     """
     Inference function needs to perturb output based on sigma
     """
-    def inference(self, x_in, keep_prob=1.0):
+    def inference(self, x_in, keep_prob=1.0, tta=False):
+        if tta:
+            y_hat_, sigma_ = self._tta_inference(x_in, keep_prob=keep_prob)
+            return y_hat_.mean(axis=0), sigma_.mean(axis=0)
+
         feed_dict = {self.x_in: x_in,
                      self.keep_prob: keep_prob,
                      self.training: False}
@@ -207,33 +218,81 @@ class SegmentationBayesian(Segmentation):
         return y_hat_, sigma_
 
 
+    """ TTA views of y_hat and sigma are kept apart so bayesian_inference can
+    treat each view as another sample """
+    def _make_tta_ops(self):
+        x_views = self._make_tta_views()
+        y_hat, sigma = self.model(x_views, keep_prob=self.keep_prob, reuse=True,
+            training=self.training)
+        self.y_hat_tta_views = tta_invert(y_hat, self.tta_transforms)
+        self.sigma_tta_views = tta_invert(sigma, self.tta_transforms)
+        self.y_tta_views = tf.nn.softmax(self.y_hat_tta_views, axis=-1)
+        self.y_tta_smax = tf.reduce_mean(self.y_tta_views, axis=0)
+
+
+    """ (n_views, n, h, w, n_classes) and (n_views, n, h, w, 1) """
+    def _tta_inference(self, x_in, keep_prob=1.0):
+        if not hasattr(self, 'x_tta'):
+            self._make_tta_ops()
+        feed_dict = {self.x_tta: x_in,
+                     self.keep_prob: keep_prob,
+                     self.training: False}
+        return self.sess.run([self.y_hat_tta_views, self.sigma_tta_views], feed_dict=feed_dict)
+
+
     """ function for approximate bayesian inference via dropout
     if ret_all is true, then we return the mean, variance and sigma images
     if ret_all is false, then we return just the softmaxed yhat
-    """
-    def bayesian_inference(self, x_in, samples=25, keep_prob=0.5, ret_all=False):
-        assert keep_prob < 1.0
-        assert x_in.shape[0] == 1 and len(x_in.shape) == 4
 
-        ## Option A: (one big iteration)
-        # x_in_stack = np.concatenate([x_in]*samples, axis=0)
-        # y_hat = self.inference(x_in=x_in_stack, keep_prob=keep_prob)
-        # y_bar_mean = np.mean(y_hat, axis=0) ## (1, h, w, n_classes)
+    x_in may hold several images. Each image is repeated `samples` times along
+    the batch axis and the stack is pushed through the graph in chunks of at most
+    `batch_size` (default self.mc_batch_size), so T samples cost ~T/batch_size
+    sess.run calls instead of T. Dropout masks are drawn per batch element,
+    so every repeat is an independent sample. Statistics are accumulated online
+    so memory does not grow with `samples`.
 
-        ## Option B: (smaller iterations)
-        y_hat_sigmas = [self.inference(x_in=x_in, keep_prob=keep_prob) for _ in xrange(samples)]
-        y_hat = [x[0] for x in y_hat_sigmas]
-        y_hat = np.stack(y_hat, axis=0)
-        y_bar_mean = np.mean(y_hat, axis=0)
+    With tta=True every repeat is also expanded to the TTA views (see
+    Segmentation.inference), so each image gets samples * n_views draws from the
+    same batched passes; batch_size still bounds the images per sess.run.
 
-        sigmas = [x[1] for x in y_hat_sigmas]
-        sigmas = np.stack(sigmas, axis=0)
+    Returns arrays with one entry per input image: (n, h, w, n_classes)
+    """
+    def bayesian_inference(self, x_in, samples=25, keep_prob=0.5, ret_all=False, batch_size=None,
+        tta=False):
+        assert keep_prob < 1.0
+        assert len(x_in.shape) == 4
+        if batch_size is None:
+            batch_size = self.mc_batch_size
+        if tta:
+            if not hasattr(self, 'x_tta'):
+                self._make_tta_ops()
+            batch_size = max(1, batch_size // len(self.tta_transforms))
+
+        n_imgs = x_in.shape[0]
+        sample_idx = np.repeat(np.arange(n_imgs), samples)
+
+        y_hat_moments = [RunningMoments() for _ in range(n_imgs)]
+        sigma_moments = [RunningMoments() for _ in range(n_imgs)]
+        for start in range(0, len(sample_idx), batch_size):
+            batch_idx = sample_idx[start:start+batch_size]
+            if tta:
+                ## (n_views, batch, ...) --> (batch, n_views, ...) so rows follow batch_idx
+                y_hat_, sigma_ = self._tta_inference(x_in[batch_idx, ...], keep_prob=keep_prob)
+                y_hat_, sigma_ = np.swapaxes(y_hat_, 0, 1), np.swapaxes(sigma_, 0, 1)
+            else:
+                y_hat_, sigma_ = self.inference(x_in=x_in[batch_idx, ...], keep_prob=keep_prob)
+            for img_idx in np.unique(batch_idx):
+                y_hat_moments[img_idx].update(
+                    y_hat_[batch_idx == img_idx].reshape((-1,) + y_hat_.shape[-3:]))
+                if ret_all:
+                    sigma_moments[img_idx].update(
+                        sigma_[batch_idx == img_idx].reshape((-1,) + sigma_.shape[-3:]))
+
+        y_bar_mean = np.stack([m.mean for m in y_hat_moments], axis=0)
 
         if ret_all:
-            y_bar_var = np.var(y_hat, axis=0)
-            sigma_bar = np.mean(sigmas, axis=0)
-            # y_bar_argmax = np.argmax(y_bar_mean, axis=-1)
-            # y_bar_argmax = np.expand_dims(y_bar_argmax, 0)
+            y_bar_var = np.stack([m.variance for m in y_hat_moments], axis=0)
+            sigma_bar = np.stack([m.mean for m in sigma_moments], axis=0)
             return y_bar_mean, y_bar_var, sigma_bar
         else:
             return y_bar_mean
@@ -242,7 +301,8 @@ class SegmentationBayesian(Segmentation):
     def test_step(self, step_delta, keep_prob=0.7):
         fd = {self.keep_prob: keep_prob,
               self.training: False}
-        summary_str, test_loss_ = self.sess.run([self.summary_test_ops, self.loss], feed_dict=fd)
+        summary_str, test_loss_ = self.sess.run([self.summary_test_ops, self.loss]
+            + self.input_fetches, feed_dict=fd)[:2]
         # self.summary_writer.add_summary(summary_str, self.global_step+step_delta)
         print('#### TEST #### [{:07d}] writing test summaries (loss={:3.3f})'.format(self.global_step, test_loss_))
         return test_loss_, summary_str
@@ -250,8 +310,11 @@ class SegmentationBayesian(Segmentation):
 
     """ Run a number of testing iterations """
     def test(self, keep_prob=0.7):
+        if self.full_test:
+            return self.evaluate()
+
         ## Switch dataset to testing
-        self.dataset._initalize_testing(self.sess)
+        self._switch_dataset('TEST')
 
         test_losses = []
         for step_delta in xrange(self.n_test_batches):
@@ -262,4 +325,4 @@ class SegmentationBayesian(Segmentation):
         print('\n#### MEAN TEST LOSS = {:3.5f} +/- {:3.6f} #####\n'.format(loss_mean, loss_std))
 
         self.summary_writer.add_summary(summary_str, self.global_step)
-        self.dataset._initalize_training(self.sess)
+        self._switch_dataset('TRAIN')
@@ -3,12 +3,36 @@ from .datasets import (
     BaggedMNIST,
     ImageComboDataSet,
     ImageFeeder,
+    SVSFeeder,
+    NumpySlide,
     TFRecordImageMask,
     TFRecordImageLabel
 )
 
 from .basemodel import BaseModel
 
+from .async_checkpoint import AsyncCheckpointWriter
+from .async_summary import AsyncSummaryWriter
+from .profiler import StepProfiler, NullProfiler
+
+from .export import export_frozen_graph, FrozenModel
+from .inference_service import BatchedInferenceService, InferenceFuture
+
+from .stats import RunningMoments
+
+from .staging import DeviceStager
+
+from .tta import (
+    dihedral_transforms,
+    tta_views,
+    tta_invert
+)
+
+from .tiling import (
+    tile_coordinates,
+    sliding_window_inference
+)
+
 from .ops import (
     batch_norm,
     conv,
@@ -35,9 +59,26 @@ __all__ = [
     'BaggedMNIST',
     'ImageComboDataSet',
     'ImageFeeder',
+    'SVSFeeder',
+    'NumpySlide',
     'TFRecordImageMask',
     'TFRecordImageLabel',
     'BaseModel',
+    'AsyncCheckpointWriter',
+    'AsyncSummaryWriter',
+    'StepProfiler',
+    'NullProfiler',
+    'export_frozen_graph',
+    'FrozenModel',
+    'BatchedInferenceService',
+    'InferenceFuture',
+    'RunningMoments',
+    'DeviceStager',
+    'tile_coordinates',
+    'sliding_window_inference',
+    'dihedral_transforms',
+    'tta_views',
+    'tta_invert',
     'batch_norm',
     'conv',
     'conv_cond_concat',
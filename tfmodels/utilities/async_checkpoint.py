@@ -0,0 +1,96 @@
+from __future__ import print_function
+import tensorflow as tf
+import atexit
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+"""
+Checkpoints written on a background thread
+
+The training thread only pays for one sess.run copying the variable values to
+host memory. A worker thread loads the values into a shadow copy of the
+variables, held in a private CPU graph, and saves that with its own
+tf.train.Saver. Checkpoint keys match the variables' names, so the files
+restore with an ordinary Saver over the same var_list, and max_to_keep and the
+`checkpoint` state file behave as with a synchronous Saver.
+
+At most `capacity` snapshots wait in the queue; save() blocks beyond that,
+so a slow disk applies back pressure instead of accumulating host copies.
+
+    writer = AsyncCheckpointWriter(var_list, max_to_keep=5)
+    writer.save(sess, '/path/model.ckpt', global_step=step)
+    writer.wait()
+"""
+
+class AsyncCheckpointWriter(object):
+    def __init__(self, var_list, max_to_keep=5, capacity=2, name='AsyncCheckpointWriter'):
+        self.var_list = list(var_list)
+        self.max_to_keep = max_to_keep
+        self.capacity = capacity
+        self.name = name
+        self.error = None
+        self.last_path = None
+
+        self.graph = tf.Graph()
+        with self.graph.as_default(), tf.device('/cpu:0'):
+            self.shadow_vars = [tf.Variable(tf.zeros(var.get_shape(), dtype=var.dtype.base_dtype),
+                                            name=var.op.name, trainable=False)
+                                for var in self.var_list]
+            self.saver = tf.train.Saver(var_list=self.shadow_vars, max_to_keep=max_to_keep)
+            init_op = tf.global_variables_initializer()
+        self.sess = tf.Session(graph=self.graph, config=tf.ConfigProto(device_count={'GPU': 0}))
+        self.sess.run(init_op)
+
+        self.queue = queue.Queue(maxsize=capacity)
+        self.thread = threading.Thread(target=self._worker, name=name)
+        self.thread.daemon = True
+        self.thread.start()
+        atexit.register(self.close)
+
+
+    """ Copy values out of sess, then queue them to be written as save_path-global_step """
+    def save(self, sess, save_path, global_step=None):
+        self._check_error()
+        values = sess.run(self.var_list)
+        self.queue.put((values, save_path, global_step))
+
+
+    """ Block until every queued snapshot is on disk """
+    def wait(self):
+        self.queue.join()
+        self._check_error()
+
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+            self.sess.close()
+
+
+    def _check_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+
+    def _worker(self):
+        while True:
+            job = self.queue.get()
+            try:
+                if job is None:
+                    return
+                values, save_path, global_step = job
+                for shadow_var, value in zip(self.shadow_vars, values):
+                    shadow_var.load(value, self.sess)
+                self.last_path = self.saver.save(self.sess, save_path,
+                    global_step=global_step, write_meta_graph=False)
+                print('[{}] wrote {}'.format(self.name, self.last_path))
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
@@ -0,0 +1,145 @@
+from __future__ import print_function
+import tensorflow as tf
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+"""
+Summary events written on a background thread
+
+AsyncSummaryWriter stands in for tf.summary.FileWriter. add_summary() never
+blocks: serialized summaries are queued and parsed, filtered and written by a
+worker thread.
+
+Back pressure:
+    - Once the queue is half full, or more than max_pending_bytes are waiting,
+      new summaries are marked low priority and the worker strips their
+      histogram and image values, keeping the scalars.
+    - When the queue is full, or a summary would exceed the byte budget,
+      it is dropped.
+
+Every report_every events the writer adds its own scalars under
+`summary_writer/`: queue depth, pending and written MB, stripped and dropped
+counts. The same numbers are available from stats().
+"""
+
+class AsyncSummaryWriter(object):
+    low_priority = ['histo', 'image']
+
+    def __init__(self, log_dir, graph=None, flush_secs=30, capacity=64,
+        max_pending_bytes=64 * 2**20, report_every=50, name='AsyncSummaryWriter'):
+        self.capacity = capacity
+        self.max_pending_bytes = max_pending_bytes
+        self.report_every = report_every
+        self.name = name
+
+        self.writer = tf.summary.FileWriter(log_dir, graph=graph, flush_secs=flush_secs)
+        self.lock = threading.Lock()
+        self.pending_bytes = 0
+        self.bytes_written = 0
+        self.n_written = 0
+        self.n_stripped = 0
+        self.n_dropped = 0
+        self.last_step = 0
+
+        self.queue = queue.Queue(maxsize=capacity)
+        self.thread = threading.Thread(target=self._worker, name=name)
+        self.thread.daemon = True
+        self.thread.start()
+
+
+    """ summary is a serialized tf.Summary (the output of a summary op) or a tf.Summary """
+    def add_summary(self, summary, global_step=None):
+        if not isinstance(summary, bytes):
+            summary = summary.SerializeToString()
+        n_bytes = len(summary)
+
+        with self.lock:
+            if self.pending_bytes + n_bytes > self.max_pending_bytes:
+                self.n_dropped += 1
+                return
+            strip = (self.queue.qsize() >= self.capacity // 2 or
+                     self.pending_bytes > self.max_pending_bytes // 2)
+            try:
+                self.queue.put_nowait((summary, global_step, strip))
+            except queue.Full:
+                self.n_dropped += 1
+                return
+            self.pending_bytes += n_bytes
+
+
+    def stats(self):
+        with self.lock:
+            return {'queue_depth': self.queue.qsize(),
+                    'pending_bytes': self.pending_bytes,
+                    'bytes_written': self.bytes_written,
+                    'written': self.n_written,
+                    'stripped': self.n_stripped,
+                    'dropped': self.n_dropped}
+
+
+    """ Wait for queued summaries to be written, then flush the event file """
+    def flush(self):
+        self.queue.join()
+        self.writer.flush()
+
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.join()
+            self.queue.put(None)
+            self.thread.join()
+        self.writer.close()
+
+
+    def _strip(self, summary):
+        kept = [value for value in summary.value
+                if value.WhichOneof('value') not in self.low_priority]
+        del summary.value[:]
+        summary.value.extend(kept)
+        return summary
+
+
+    def _report(self):
+        stats = self.stats()
+        summary = tf.Summary(value=[
+            tf.Summary.Value(tag='summary_writer/queue_depth', simple_value=stats['queue_depth']),
+            tf.Summary.Value(tag='summary_writer/pending_mb', simple_value=stats['pending_bytes'] / 2.**20),
+            tf.Summary.Value(tag='summary_writer/written_mb', simple_value=stats['bytes_written'] / 2.**20),
+            tf.Summary.Value(tag='summary_writer/stripped', simple_value=stats['stripped']),
+            tf.Summary.Value(tag='summary_writer/dropped', simple_value=stats['dropped']) ])
+        self.writer.add_summary(summary, self.last_step)
+
+
+    def _worker(self):
+        while True:
+            job = self.queue.get()
+            try:
+                if job is None:
+                    return
+                serialized, global_step, strip = job
+                if strip:
+                    summary = self._strip(tf.Summary.FromString(serialized))
+                    self.writer.add_summary(summary, global_step)
+                    n_bytes = summary.ByteSize()
+                else:
+                    self.writer.add_summary(serialized, global_step)
+                    n_bytes = len(serialized)
+
+                with self.lock:
+                    self.pending_bytes -= len(serialized)
+                    self.bytes_written += n_bytes
+                    self.n_written += 1
+                    self.n_stripped += int(strip)
+                    if global_step is not None:
+                        self.last_step = global_step
+
+                if self.n_written % self.report_every == 0:
+                    self._report()
+            except Exception as e:
+                print('[{}] failed to write summary: {}'.format(self.name, e))
+            finally:
+                self.queue.task_done()
@@ -3,16 +3,23 @@ import tensorflow as tf
 import numpy as np
 import datetime, os
 
+from .async_checkpoint import AsyncCheckpointWriter
+from .async_summary import AsyncSummaryWriter
+from .profiler import StepProfiler, NullProfiler
+
 """
 BaseModel serves as a template for downstream models:
 
 input -->> tensor operations -->> loss/output
 
 It holds shared operations such as
-    - snapshot
+    - snapshot (optionally written on a background thread: async_snapshot=True)
     - restore
     - get update list
-    - tensorflow boilerplate code
+    - tensorflow boilerplate code (summaries optionally written on a background
+      thread with a bounded queue: async_summaries=True)
+    - step profiling (profile=True): per-phase step times, examples/s and
+      periodic Chrome traces, see profiler.py
     - printing model settings to terminal, or to file
 
 """
@@ -20,6 +27,14 @@ class BaseModel(object):
     ## Defaults
     def __init__(self, **kwargs):
         base_defaults={
+            'async_snapshot': False,
+            'async_summaries': False,
+            'profile': False,
+            'profile_report_every': 50,
+            'profile_trace_every': 0,
+            'summary_queue': 64,
+            'summary_queue_bytes': 64 * 2**20,
+            'snapshot_queue': 2,
             'sess': None,
             'global_step': 0,
             'log_dir': None,
@@ -35,6 +50,8 @@ class BaseModel(object):
         for key, value in base_defaults.items():
             setattr(self, key, value)
 
+        self.profiler = NullProfiler()
+
 
     def get_update_list(self):
         t_vars = tf.trainable_variables()
@@ -55,6 +72,10 @@ class BaseModel(object):
         # except:
         #     print 'Failed! Continuing without loading snapshot.'
 
+        ## Let pending asynchronous snapshots land first
+        if getattr(self, 'checkpoint_writer', None) is not None:
+            self.checkpoint_writer.wait()
+
         self.saver.restore(self.sess, snapshot_path)
         print('Success!')
 
@@ -66,6 +87,16 @@ class BaseModel(object):
         #     print 'Snapshotting to [{}] step [{}]'.format(snap_dir, step),
         #     saver.save(self.sess, snap_dir, global_step=step)
 
+        with self.profiler.phase('checkpoint'):
+            self._snapshot()
+
+
+    def _snapshot(self):
+        if getattr(self, 'checkpoint_writer', None) is not None:
+            print('Queueing snapshot to [{}] step [{}]'.format(self.snapshot_path, self.global_step))
+            self.checkpoint_writer.save(self.sess, self.snapshot_path, global_step=self.global_step)
+            return
+
         print('Snapshotting to [{}] step [{}]'.format(self.snapshot_path, self.global_step),
         self.saver.save(self.sess, self.snapshot_path, global_step=self.global_step))
         print('Done')
@@ -85,14 +116,33 @@ class BaseModel(object):
         self._count_params()
 
         # with tf.device('/cpu:0'):
-        self.summary_writer = tf.summary.FileWriter(self.log_dir,
-            graph=self.sess.graph, flush_secs=30)
+        if self.async_summaries:
+            self.summary_writer = AsyncSummaryWriter(self.log_dir,
+                graph=self.sess.graph, flush_secs=30, capacity=self.summary_queue,
+                max_pending_bytes=self.summary_queue_bytes,
+                name='{}_summary_writer'.format(self.name))
+        else:
+            self.summary_writer = tf.summary.FileWriter(self.log_dir,
+                graph=self.sess.graph, flush_secs=30)
 
         ## Append a model name to the save path
         self.snapshot_path = os.path.join(self.save_dir, '{}.ckpt'.format(self.name))
 
         ## april 19 - add var list that is only trainable variables - NI
         self.saver = tf.train.Saver(var_list=self.var_list, max_to_keep=self.max_to_keep)
+        if self.async_snapshot:
+            self.checkpoint_writer = AsyncCheckpointWriter(self.var_list,
+                max_to_keep=self.max_to_keep, capacity=self.snapshot_queue,
+                name='{}_checkpoint_writer'.format(self.name))
+
+        if self.profile:
+            trace_dir = None
+            if self.profile_trace_every > 0:
+                trace_dir = os.path.join(self.log_dir, 'traces')
+            self.profiler = StepProfiler(summary_writer=self.summary_writer,
+                trace_dir=trace_dir, trace_every=self.profile_trace_every,
+                report_every=self.profile_report_every,
+                name='{}_profiler'.format(self.name))
 
 
 
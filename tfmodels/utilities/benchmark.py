@@ -0,0 +1,287 @@
+from __future__ import print_function
+import tensorflow as tf
+import numpy as np
+import cv2
+import collections
+import datetime
+import itertools
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from .datasets import TFRecordImageMask, TFRecordImageLabel, ImageFeeder, BaggedMNIST
+from .general import image_mask_2_tfrecord, _bytes_feature, _int64_feature, _encode_array
+
+"""
+Input pipeline benchmarks
+
+Each dataset class is built over every combination of a parameter grid, on
+synthetic data written to a scratch directory, and timed batch by batch:
+
+    results = run_benchmarks(datasets=['TFRecordImageMask', 'ImageFeeder'],
+        grid={'n_threads': [2, 8], 'batch_size': [16, 32]},
+        output='input_benchmark.json')
+
+or from the shell:
+
+    python -m tfmodels.utilities.benchmark --output input_benchmark.json
+
+Reported per configuration:
+    examples_per_sec          after `warmup` batches
+    p50_ms / p95_ms / p99_ms  per-batch latency
+    cpu_cores                 process CPU time / wall time (user + system)
+    peak_rss_mb               process high-water RSS after the run. This never
+                              decreases, so compare it between runs in separate processes.
+
+Grid keys are n_threads, prefetch, shuffle_buffer and batch_size; each is
+mapped to the dataset's own argument (prefetch is prefetch_batches for the
+TFRecord datasets), and ignored where it does not apply
+(BaggedMNIST is a python generator and only uses batch_size).
+"""
+
+DEFAULT_GRID = collections.OrderedDict([
+    ('n_threads', [1, 4]),
+    ('prefetch', [1, 4]),
+    ('shuffle_buffer', [64, 512]),
+    ('batch_size', [16]),
+])
+
+
+def param_grid(grid):
+    keys = list(grid.keys())
+    for values in itertools.product(*[grid[key] for key in keys]):
+        yield collections.OrderedDict(zip(keys, values))
+
+
+## ------------------- Synthetic data ------------------- ##
+
+def _random_image_mask(size, n_classes):
+    ## Smooth blobs, so encoded sizes are closer to real tiles than white noise
+    img = cv2.resize(np.random.randint(0, 255, (size//16, size//16, 3)).astype(np.uint8),
+        (size, size), interpolation=cv2.INTER_LINEAR)
+    mask = cv2.resize(np.random.randint(0, n_classes, (size//32, size//32)).astype(np.uint8),
+        (size, size), interpolation=cv2.INTER_NEAREST)
+    return img, mask
+
+
+def write_synthetic_image_mask(work_dir, n_examples=64, size=256, n_classes=2,
+    encoding='raw', compression=None, n_shards=1):
+    img_dir = os.path.join(work_dir, 'img')
+    mask_dir = os.path.join(work_dir, 'mask')
+    for d in [img_dir, mask_dir]:
+        if not os.path.exists(d):
+            os.makedirs(d)
+
+    for idx in range(n_examples):
+        img, mask = _random_image_mask(size, n_classes)
+        cv2.imwrite(os.path.join(img_dir, '{:05d}.png'.format(idx)), img)
+        cv2.imwrite(os.path.join(mask_dir, '{:05d}.png'.format(idx)), mask)
+
+    record_path = os.path.join(work_dir, 'image_mask.tfrecord')
+    image_mask_2_tfrecord(os.path.join(img_dir, '*.png'), os.path.join(mask_dir, '*.png'),
+        record_path, n_classes=n_classes, n_shards=n_shards, encoding=encoding,
+        compression=compression)
+    return record_path
+
+
+def write_synthetic_image_label(work_dir, n_examples=64, size=256, n_classes=2, encoding='raw'):
+    record_path = os.path.join(work_dir, 'image_label.tfrecord')
+    writer = tf.python_io.TFRecordWriter(record_path)
+    for idx in range(n_examples):
+        img, _ = _random_image_mask(size, n_classes)
+        img_raw = img.tobytes() if encoding == 'raw' else _encode_array(img, encoding)
+        example = tf.train.Example(features=tf.train.Features(feature={
+            'height': _int64_feature(size),
+            'width': _int64_feature(size),
+            'img': _bytes_feature(img_raw),
+            'y': _int64_feature(idx % n_classes) }))
+        writer.write(example.SerializeToString())
+    writer.close()
+    return record_path
+
+
+def write_synthetic_images(work_dir, n_examples=64, size=256):
+    image_dir = os.path.join(work_dir, 'images')
+    if not os.path.exists(image_dir):
+        os.makedirs(image_dir)
+    for idx in range(n_examples):
+        img, _ = _random_image_mask(size, 2)
+        cv2.imwrite(os.path.join(image_dir, '{:05d}.jpg'.format(idx)), img)
+    return image_dir
+
+
+SyntheticMNIST = collections.namedtuple('SyntheticMNIST', ['images', 'labels'])
+
+def synthetic_mnist(n_examples=2000):
+    return SyntheticMNIST(images=np.random.rand(n_examples, 784).astype(np.float32),
+        labels=np.random.randint(0, 10, n_examples))
+
+
+## ------------------- Dataset builders ------------------- ##
+## Each returns a function pulling one batch
+
+def _build_image_mask(sess, params, data, crop_size):
+    dataset = TFRecordImageMask(training_record=data, crop_size=crop_size, ratio=1.0,
+        n_classes=2, batch_size=params['batch_size'], n_threads=params['n_threads'],
+        prefetch_batches=params['prefetch'], shuffle_buffer=params['shuffle_buffer'],
+        preprocess=[], sess=sess)
+    return lambda: sess.run([dataset.image_op, dataset.mask_op])
+
+
+def _build_image_label(sess, params, data, crop_size):
+    dataset = TFRecordImageLabel(training_record=data, crop_size=crop_size, ratio=1.0,
+        n_classes=2, batch_size=params['batch_size'], n_threads=params['n_threads'],
+        prefetch_batches=params['prefetch'], shuffle_buffer=params['shuffle_buffer'],
+        preprocess=[], sess=sess)
+    return lambda: sess.run([dataset.image_op, dataset.label_op])
+
+
+def _build_image_feeder(sess, params, data, crop_size):
+    dataset = ImageFeeder(image_dir=data, image_ext='jpg', crop_size=crop_size,
+        batch_size=params['batch_size'], threads=params['n_threads'],
+        prefetch=params['prefetch'])
+    return lambda: dataset.get_batch(sess)
+
+
+def _build_bagged_mnist(sess, params, data, crop_size):
+    dataset = BaggedMNIST(data=data, batch_size=params['batch_size'], as_images=True)
+    return lambda: next(dataset.iterator)
+
+
+BUILDERS = collections.OrderedDict([
+    ('TFRecordImageMask', _build_image_mask),
+    ('TFRecordImageLabel', _build_image_label),
+    ('ImageFeeder', _build_image_feeder),
+    ('BaggedMNIST', _build_bagged_mnist),
+])
+
+
+def _synthetic_data(name, work_dir, n_examples, size):
+    if name == 'TFRecordImageMask':
+        return write_synthetic_image_mask(os.path.join(work_dir, name), n_examples, size)
+    elif name == 'TFRecordImageLabel':
+        d = os.path.join(work_dir, name)
+        os.makedirs(d)
+        return write_synthetic_image_label(d, n_examples, size)
+    elif name == 'ImageFeeder':
+        return write_synthetic_images(os.path.join(work_dir, name), n_examples, size)
+    elif name == 'BaggedMNIST':
+        return synthetic_mnist()
+    raise Exception('No benchmark for dataset {}; choose from {}'.format(name, list(BUILDERS.keys())))
+
+
+## ------------------- Timing ------------------- ##
+
+def _cpu_seconds():
+    if resource is None:
+        return time.process_time() if hasattr(time, 'process_time') else time.clock()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    ## ru_maxrss is KB on linux, bytes on macOS
+    scale = 2.**20 if platform.system() == 'Darwin' else 2.**10
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+""" Time n_batches calls to pull_fn after `warmup` untimed calls """
+def time_batches(pull_fn, batch_size, n_batches=50, warmup=5):
+    for _ in range(warmup):
+        pull_fn()
+
+    latencies = []
+    cpu_start = _cpu_seconds()
+    wall_start = time.time()
+    for _ in range(n_batches):
+        tstart = time.time()
+        pull_fn()
+        latencies.append(time.time() - tstart)
+    wall = time.time() - wall_start
+    cpu = _cpu_seconds() - cpu_start
+
+    latencies = np.array(latencies) * 1000.
+    return collections.OrderedDict([
+        ('examples_per_sec', batch_size * n_batches / wall),
+        ('p50_ms', float(np.percentile(latencies, 50))),
+        ('p95_ms', float(np.percentile(latencies, 95))),
+        ('p99_ms', float(np.percentile(latencies, 99))),
+        ('mean_ms', float(np.mean(latencies))),
+        ('cpu_cores', cpu / wall),
+        ('peak_rss_mb', _peak_rss_mb()),
+    ])
+
+
+def run_benchmarks(datasets=None, grid=None, n_batches=50, warmup=5, n_examples=64,
+    size=256, crop_size=128, work_dir=None, output=None):
+    if datasets is None:
+        datasets = list(BUILDERS.keys())
+    if grid is None:
+        grid = DEFAULT_GRID
+
+    cleanup = work_dir is None
+    if work_dir is None:
+        work_dir = tempfile.mkdtemp(prefix='tfmodels_benchmark_')
+
+    results = []
+    try:
+        for name in datasets:
+            data = _synthetic_data(name, work_dir, n_examples, size)
+            for params in param_grid(grid):
+                tf.reset_default_graph()
+                result = collections.OrderedDict([('dataset', name), ('params', params)])
+                try:
+                    with tf.Session() as sess:
+                        pull_fn = BUILDERS[name](sess, params, data, crop_size)
+                        result.update(time_batches(pull_fn, params['batch_size'],
+                            n_batches=n_batches, warmup=warmup))
+                except Exception as e:
+                    result['error'] = '{}: {}'.format(type(e).__name__, e)
+                print(json.dumps(result))
+                results.append(result)
+    finally:
+        if cleanup:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = collections.OrderedDict([
+        ('created', datetime.datetime.now().strftime("%Y_%m_%d_%H_%M_%S")),
+        ('tensorflow', tf.__version__),
+        ('python', platform.python_version()),
+        ('host', platform.node()),
+        ('n_batches', n_batches),
+        ('warmup', warmup),
+        ('results', results),
+    ])
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print('Wrote benchmark results to {}'.format(output))
+    return report
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmark tfmodels input pipelines')
+    parser.add_argument('--datasets', nargs='+', default=list(BUILDERS.keys()))
+    parser.add_argument('--n_threads', nargs='+', type=int, default=DEFAULT_GRID['n_threads'])
+    parser.add_argument('--prefetch', nargs='+', type=int, default=DEFAULT_GRID['prefetch'])
+    parser.add_argument('--shuffle_buffer', nargs='+', type=int, default=DEFAULT_GRID['shuffle_buffer'])
+    parser.add_argument('--batch_size', nargs='+', type=int, default=DEFAULT_GRID['batch_size'])
+    parser.add_argument('--n_batches', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--output', default='input_benchmark.json')
+    args = parser.parse_args()
+
+    grid = collections.OrderedDict([(key, getattr(args, key)) for key in DEFAULT_GRID.keys()])
+    run_benchmarks(datasets=args.datasets, grid=grid, n_batches=args.n_batches,
+        warmup=args.warmup, output=args.output)
@@ -4,3 +4,4 @@ from .tfrecord_image_label import TFRecordImageLabel
 from .bagged_mnist import BaggedMNIST, MNISTDataSet
 from .image_combo import ImageComboDataSet
 from .image_feeder import ImageFeeder
+from .svs_feeder import SVSFeeder, NumpySlide
@@ -1,23 +1,26 @@
 """
-Implements a threaded queue for reading images from disk given filenames
-Since this is for segmentation, we have to also read masks in the same order
+Base class for datasets that read image files from a directory with tf.data
 
-Assume the images and masks are named similarly and are in different folders
+The file list is shuffled each epoch; files are read, decoded and cropped by
+`threads` parallel calls, then batched and prefetched. Subclasses implement
+_preprocessing and call _make_dataset.
 """
 
 from __future__ import print_function
+import tensorflow as tf
 
 class DataSet(object):
     def __init__(self, **kwargs):
         defaults = {
             'capacity': 5000,
             'name': 'DataSet',
+            'prefetch': 2,
             'seed': 5555,
             'threads': 4,
             'min_holding': 1250,}
 
         defaults.update(**kwargs)
-        for key, value in kwargs.items():
+        for key, value in defaults.items():
             setattr(self, key, value)
 
         assert self.batch_size >= 1
@@ -31,6 +34,34 @@ class DataSet(object):
         print('-------------------- {} ---------------------- '.format(self.name))
 
 
+    """ Read and decode one image file in its stored dtype """
+    def _read_image(self, path, channels):
+        contents = tf.read_file(path)
+        if self.image_ext.lower() in ['jpg', 'jpeg']:
+            image = tf.image.decode_jpeg(contents, channels=channels)
+        elif self.image_ext.lower() == 'png':
+            image = tf.image.decode_png(contents, channels=channels)
+        else:
+            image = tf.image.decode_image(contents, channels=channels)
+        image.set_shape([None, None, channels])
+        return image
+
+
+    """ Build the file list -> read/preprocess -> batch -> prefetch pipeline.
+    Returns the iterator's next element. """
+    def _make_dataset(self, image_list, map_fn):
+        assert len(image_list) > 0, 'No images found in {}'.format(self.image_dir)
+        self.dataset = (tf.data.Dataset.from_tensor_slices(image_list)
+                        .shuffle(buffer_size=len(image_list), seed=self.seed)
+                        .repeat()
+                        .map(map_fn, num_parallel_calls=self.threads)
+                        .batch(self.batch_size)
+                        .prefetch(buffer_size=self.prefetch) )
+
+        self.iterator = self.dataset.make_one_shot_iterator()
+        return self.iterator.get_next()
+
+
     def _preprocessing(self, image, mask):
         raise Exception(NotImplementedError)
 
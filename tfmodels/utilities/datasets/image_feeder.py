@@ -1,6 +1,6 @@
 from __future__ import print_function
 import tensorflow as tf
-from dataset_base import DataSet
+from .dataset_base import DataSet
 import glob, os
 
 """
@@ -20,60 +20,43 @@ class ImageFeeder(DataSet):
             'image_ext': 'jpg',
             'min_holding': 1250,
             'name': 'ImageFeeder',
+            'prefetch': 2,
             'ratio': 1.0,
             'seed': 5555,
-            'threads': 1,
+            'threads': 4,
         }
         defaults.update(kwargs)
         super(ImageFeeder, self).__init__(**defaults)
         assert self.image_dir is not None
 
         ## ----------------- Load Image Lists ------------------- ##
-        image_list = sorted(glob.glob(os.path.join(self.image_dir, '*.'+self.image_ext) ))
-        self.image_names = tf.convert_to_tensor(image_list)
+        self.image_list = sorted(glob.glob(os.path.join(self.image_dir, '*.'+self.image_ext) ))
 
-        ## ----------------- Queue ops to feed ----------------- ##
-        self.feature_queue = tf.train.string_input_producer(self.image_names,
-            shuffle=False,
-            seed=self.seed)
-
-        self.image_reader = tf.WholeFileReader()
-        image_key, image_file = self.image_reader.read(self.feature_queue)
-        image = tf.image.decode_image(image_file, channels=self.channels)
-        print(image.get_shape())
-
-        #with tf.device('/cpu:0'):
-        image = self._preprocessing(image)
-
-        self.image_op = tf.train.shuffle_batch([image],
-            batch_size = self.batch_size,
-            capacity   = self.capacity,
-            num_threads = self.threads,
-            min_after_dequeue = self.min_holding,
-            name = 'Dataset')
+        ## ----------------- tf.data pipeline ----------------- ##
+        self.image_op = self._make_dataset(self.image_list,
+            lambda path: self._preprocessing(self._read_image(path, self.channels)))
 
 
+    """ Crop and flip in uint8, then cast only the crop """
     def _preprocessing(self, image):
-        image = tf.cast(image, tf.float32)
-
-        ## ????
         image = tf.random_crop(image,
             [self.crop_size, self.crop_size, self.channels])
 
-        ## Cropping
         if self.augmentation == 'random':
             image = tf.image.random_flip_left_right(image)
             image = tf.image.random_flip_up_down(image)
 
+        image = tf.cast(image, tf.float32)
+        if self.augmentation == 'random':
             image = tf.image.random_brightness(image, max_delta=0.05)
             image = tf.image.random_contrast(image, lower=0.75, upper=1.0)
             image = tf.image.random_hue(image, max_delta=0.05)
             image = tf.image.random_saturation(image, lower=0.75, upper=1.0)
 
         ## Resize ratio
-        target_h = tf.cast(self.crop_size*self.ratio, tf.int32)
-        target_w = tf.cast(self.crop_size*self.ratio, tf.int32)
-        image = tf.image.resize_images(image, [target_h, target_w])
+        if self.ratio != 1.0:
+            target_size = int(self.crop_size*self.ratio)
+            image = tf.image.resize_images(image, [target_size, target_size])
 
         ## Move to [-1, 1] for SELU activations
         image = tf.multiply(image, 2/255.0) - 1
@@ -0,0 +1,135 @@
+from __future__ import print_function
+import glob
+import json
+import os
+
+"""
+Sharded tfrecords and their manifests
+
+image_mask_2_tfrecord(..., record_path='train.tfrecord', n_shards=4) writes
+
+    train-00000-of-00004.tfrecord
+    ...
+    train-00003-of-00004.tfrecord
+    train.manifest.json
+
+The manifest lists each shard's file name (relative to the manifest), example count
+and size on disk, along with the settings used to write the records.
+
+The dataset classes accept a record as any of:
+    - a single file
+    - a glob, e.g. 'train-*.tfrecord'
+    - a manifest, e.g. 'train.manifest.json'
+    - the record_path originally given to the writer, if its manifest exists
+    - a list of any of the above
+"""
+
+def manifest_path(record_path):
+    return os.path.splitext(record_path)[0] + '.manifest.json'
+
+
+def shard_paths(record_path, n_shards):
+    if n_shards == 1:
+        return [record_path]
+    base, ext = os.path.splitext(record_path)
+    return ['{}-{:05d}-of-{:05d}{}'.format(base, idx, n_shards, ext)
+            for idx in range(n_shards)]
+
+
+def write_manifest(record_path, shards, **info):
+    path = manifest_path(record_path)
+    manifest_dir = os.path.dirname(os.path.abspath(path))
+    shards = [dict(shard, path=os.path.relpath(os.path.abspath(shard['path']), manifest_dir))
+              for shard in shards]
+
+    manifest = dict(info)
+    manifest.update({
+        'n_shards': len(shards),
+        'n_examples': sum(shard['n_examples'] for shard in shards),
+        'n_bytes': sum(shard['n_bytes'] for shard in shards),
+        'shards': shards })
+
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    print('Wrote manifest [{}] ({} shards, {} examples, {:3.1f} MB)'.format(
+        path, manifest['n_shards'], manifest['n_examples'], manifest['n_bytes'] / 2.**20))
+    return manifest
+
+
+""" Load a manifest; shard paths are returned relative to the working directory """
+def read_manifest(path):
+    with open(path, 'r') as f:
+        manifest = json.load(f)
+
+    manifest_dir = os.path.dirname(os.path.abspath(path))
+    for shard in manifest['shards']:
+        shard['path'] = os.path.join(manifest_dir, shard['path'])
+    return manifest
+
+
+""" Return the manifest written alongside record_path, or None """
+def find_manifest(record_path):
+    if record_path.endswith('.json'):
+        return read_manifest(record_path)
+    path = manifest_path(record_path)
+    if os.path.exists(path):
+        return read_manifest(path)
+    return None
+
+
+""" Expand a record, glob, manifest or list of these into a list of files """
+def expand_records(record):
+    if isinstance(record, (list, tuple)):
+        files = []
+        for rec in record:
+            files += expand_records(rec)
+        return files
+
+    if glob.has_magic(record):
+        files = sorted(glob.glob(record))
+        assert len(files) > 0, 'No records match {}'.format(record)
+        return files
+
+    if record.endswith('.json') or not os.path.exists(record):
+        manifest = find_manifest(record)
+        if manifest is not None:
+            return [shard['path'] for shard in manifest['shards']]
+    return [record]
+
+
+""" The manifest describing record. For a list or glob, the first entry's manifest is used """
+def record_manifest(record):
+    if isinstance(record, (list, tuple)):
+        record = record[0]
+    if glob.has_magic(record):
+        files = sorted(glob.glob(record))
+        record = files[0] if len(files) > 0 else record
+    manifest = find_manifest(record)
+    if manifest is None:
+        manifest = _find_shard_manifest(record)
+    return manifest
+
+
+""" (encoding, compression) recorded for record, defaulting to raw, uncompressed """
+def record_format(record):
+    manifest = record_manifest(record)
+    if manifest is None:
+        return 'raw', None
+    return manifest.get('encoding', 'raw'), manifest.get('compression', None)
+
+
+""" Mean serialized example size on disk in bytes, or None without a manifest """
+def average_example_bytes(record):
+    manifest = record_manifest(record)
+    if manifest is None or manifest['n_examples'] == 0:
+        return None
+    return manifest['n_bytes'] / float(manifest['n_examples'])
+
+
+""" base-00000-of-00004.ext -> base.manifest.json """
+def _find_shard_manifest(shard_path):
+    base, ext = os.path.splitext(shard_path)
+    parts = base.rsplit('-', 3)
+    if len(parts) != 4 or parts[2] != 'of':
+        return None
+    return find_manifest(parts[0] + ext)
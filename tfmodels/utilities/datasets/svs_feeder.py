@@ -1,47 +1,110 @@
 from __future__ import print_function
 import tensorflow as tf
-import cv2
 import numpy as np
+import threading
+import cv2
+import os
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
-from opeslide import OpenSlide
+try:
+    from openslide import OpenSlide
+except ImportError:
+    OpenSlide = None
+
+from ..tiling import tile_coordinates, tile_starts
 
 """
 SVS loader to asynchronously pull from coordinates in an svs
 and feed an image_op.
 
-Accept a single svs file, and a list of coordinates and the level to read from
-use py_func option in tf.data.Dataset
+Accept a single svs file, and a list of coordinates and the level to read from.
+Tiles are read by a pool of `n_threads` reader threads, each with its own slide
+handle, into a bounded queue of `prefetch` tiles. tf.data.Dataset.from_generator
+drains the queue, so reads overlap with whatever the graph is doing.
 
-use py_func to preprocess. Accept a function to use for preprocessing
-from the outside.
-function should be of the form f(mask) --> mask_ , where dim(mask) = dim(mask_)
+Accept a function to use for preprocessing from the outside.
+function should be of the form f(tile) --> tile_ , where dim(tile) = dim(tile_)
 
 https://www.tensorflow.org/api_docs/python/tf/data/Dataset#from_generator
 
+    feeder = SVSFeeder(svsfile='slide.svs', level=1, tile_size=512, sess=sess)
+    while True:
+        try:
+            tiles, coords = sess.run([feeder.image_op, feeder.coord_op])
+        except tf.errors.OutOfRangeError:
+            break
+
+coords are (x, y) upper left corners in level 0 pixels, as in OpenSlide.read_region.
 """
 
 class SVSFeeder(object):
     def __init__(self, **kwargs):
         svs_feeder_defaults = {
-            'svsfile': None,
-            'tile_size': 512,
+            'batch_size': 16,
+            'cache_dir': None, ## Where to keep foreground indices. Defaults to the slide's dir
+            'coords': None, ## [(x, y), ...] in level 0 pixels. None reads the whole grid
             'downsample': 0.5,
+            'find_foreground': True, ## Drop background grid tiles. Only used when coords is None
+            'foreground_min': 0.1, ## Minimum tissue fraction for a tile to be read
+            'level': 0,
+            'n_threads': 4,
+            'name': 'SVSFeeder',
             'overlap_fact': 1.5,
-            'level': 0, }
+            'prefetch': 64, ## Tiles held in the reader queue
+            'preprocess_fn': None,
+            'sess': None,
+            'slide_reader': None, ## f(svsfile) --> slide. Defaults to OpenSlide
+            'svsfile': None, ## Path, or an object with the OpenSlide interface
+            'thumbnail_size': 2048,
+            'tile_size': 512, }
 
         svs_feeder_defaults.update(kwargs)
         for key, val in svs_feeder_defaults.items():
             setattr(self, key, val)
 
-        assert self.svsffile is not None
-        assert self.coords is not None
+        assert self.svsfile is not None
 
         self._prepare_generator()
 
-        self.dataset = tf.data.Dataset.from_generator(self._generator,
-            tf.float32, tf.TensorShape([]))
+        out_size = self.output_size
+        self.dataset = (tf.data.Dataset.from_generator(self._generator,
+                            output_types=(tf.uint8, tf.int64),
+                            output_shapes=(tf.TensorShape([out_size, out_size, 3]),
+                                           tf.TensorShape([2])))
+                        .map(self._preprocess, num_parallel_calls=self.n_threads)
+                        .batch(self.batch_size)
+                        .prefetch(1) )
         self.iterator = self.dataset.make_initializable_iterator()
-        self.image_op = self.iterator.get_next()
+        self.image_op, self.coord_op = self.iterator.get_next()
+
+        if self.sess is not None:
+            self.initialize(self.sess)
+
+
+    def initialize(self, sess):
+        sess.run(self.iterator.initializer)
+
+
+    def _open_slide(self):
+        if hasattr(self.svsfile, 'read_region'):
+            return self.svsfile
+
+        if self.slide_reader is not None:
+            return self.slide_reader(self.svsfile)
+
+        if OpenSlide is None:
+            raise Exception('SVSFeeder requires openslide-python, or pass a slide_reader')
+        return OpenSlide(self.svsfile)
+
+
+    def _close_slide(self, slide):
+        ## Only close handles that we opened
+        if slide is not self.svsfile and hasattr(slide, 'close'):
+            slide.close()
 
 
     """ Examine the svs file and populate:
@@ -50,30 +113,297 @@ class SVSFeeder(object):
     - downsample factor from max --> level
     """
     def _get_svs_info(self):
-        pass
+        slide = self._open_slide()
+        self.dimensions = slide.dimensions
+        self.level_dimensions = slide.level_dimensions[self.level]
+        self.level_downsample = slide.level_downsamples[self.level]
+        try:
+            self.magnification = float(slide.properties['openslide.objective-power'])
+        except (AttributeError, KeyError, ValueError):
+            self.magnification = None
+        self._close_slide(slide)
+
+        self.output_size = int(self.tile_size * self.downsample)
 
 
     """ Return list of foreground coordinates
+
+    Tissue is found on a low resolution thumbnail (see find_tissue). Each grid tile
+    is kept if at least `foreground_min` of its area is tissue. The boolean
+    (n_rows, n_cols) tile index is cached to disk next to the slide, or in cache_dir.
+
+    Also sets self.tissue_mask, the thumbnail resolution mask. It covers the whole
+    slide, so it can be passed as `foreground` to sliding_window_inference
+    at any level.
     """
-    def _find_foreground(self):
-        pass
+    def _find_foreground(self, coords):
+        cache_path = self._foreground_cache_path()
+        if cache_path is not None and os.path.exists(cache_path):
+            with np.load(cache_path) as cached:
+                self.tissue_mask = np.unpackbits(cached['tissue_mask'])[:np.prod(
+                    cached['mask_shape'])].reshape(cached['mask_shape']).astype(np.bool_)
+                self.foreground_index = np.unpackbits(cached['foreground_index'])[:np.prod(
+                    cached['index_shape'])].reshape(cached['index_shape']).astype(np.bool_)
+            print('{} loaded foreground index {}'.format(self.name, cache_path))
+        else:
+            slide = self._open_slide()
+            thumbnail = get_thumbnail(slide, self.thumbnail_size)
+            self._close_slide(slide)
+
+            self.tissue_mask = find_tissue(thumbnail)
+            self.foreground_index = self._tile_foreground(coords)
+            if cache_path is not None:
+                np.savez(cache_path,
+                    tissue_mask=np.packbits(self.tissue_mask),
+                    mask_shape=np.array(self.tissue_mask.shape),
+                    foreground_index=np.packbits(self.foreground_index),
+                    index_shape=np.array(self.foreground_index.shape))
+
+        keep = self.foreground_index.ravel()
+        print('{} foreground: {} of {} tiles'.format(self.name, keep.sum(), len(keep)))
+        return [coord for coord, k in zip(coords, keep) if k]
+
+
+    """ Fraction of tissue under each grid tile, from an integral image of the mask """
+    def _tile_foreground(self, coords):
+        mask_h, mask_w = self.tissue_mask.shape
+        scale_x = mask_w / float(self.dimensions[0])
+        scale_y = mask_h / float(self.dimensions[1])
+        extent = self.tile_size * self.level_downsample
+        integral = cv2.integral(self.tissue_mask.astype(np.uint8))
+
+        keep = np.zeros(len(coords), dtype=np.bool_)
+        for idx, (x, y) in enumerate(coords):
+            x0 = min(int(x * scale_x), mask_w-1)
+            y0 = min(int(y * scale_y), mask_h-1)
+            x1 = min(max(int(np.ceil((x + extent) * scale_x)), x0+1), mask_w)
+            y1 = min(max(int(np.ceil((y + extent) * scale_y)), y0+1), mask_h)
+            area = (x1 - x0) * (y1 - y0)
+            tissue = integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]
+            keep[idx] = tissue >= self.foreground_min * area
+
+        return keep.reshape(self.grid_shape)
+
+
+    def _foreground_cache_path(self):
+        ## Slide objects passed in directly have no path to key the cache on
+        if hasattr(self.svsfile, 'read_region'):
+            return None
+        cache_dir = self.cache_dir
+        if cache_dir is None:
+            cache_dir = os.path.dirname(os.path.abspath(self.svsfile))
+        base = os.path.splitext(os.path.basename(self.svsfile))[0]
+        return os.path.join(cache_dir, '{}_fg_l{}_t{}_o{}_f{}.npz'.format(
+            base, self.level, self.tile_size, self.overlap_fact, self.foreground_min))
+
+
+    """ Evenly spaced grid over the whole slide at self.level, in level 0 pixels """
+    def _grid_coords(self):
+        w, h = self.level_dimensions
+        n_tiles = [int(np.ceil(h / float(self.tile_size)) * self.overlap_fact),
+                   int(np.ceil(w / float(self.tile_size)) * self.overlap_fact)]
+        self.grid_shape = (len(tile_starts(h, self.tile_size, n_tiles[0])),
+                           len(tile_starts(w, self.tile_size, n_tiles[1])))
+        coords = tile_coordinates(h, w, self.tile_size, n_tiles=n_tiles)
+        return [(int(x * self.level_downsample), int(y * self.level_downsample))
+                for y, x in coords]
 
 
     """ Function to be run before constructing the dataset """
     def _prepare_generator(self):
-        pass
+        self._get_svs_info()
+        if self.coords is None:
+            self.coords = self._grid_coords()
+            if self.find_foreground:
+                self.coords = self._find_foreground(self.coords)
+        self.coords = [tuple(int(c) for c in coord) for coord in self.coords]
+        print('{} prepared {} tiles at level {}'.format(self.name, len(self.coords), self.level))
 
 
-    def _preprocess(self):
-        pass
+    def _preprocess(self, tile, coord):
+        ## Move to [-1, 1] for SELU activations
+        tile = tf.cast(tile, tf.float32)
+        tile = tf.multiply(tile, 2/255.0) - 1
+        return tile, coord
+
+
+    def _read_tile(self, slide, coord):
+        tile = slide.read_region(coord, self.level, (self.tile_size, self.tile_size))
+        tile = np.array(tile)[:, :, :3]
+
+        if self.output_size != self.tile_size:
+            tile = cv2.resize(tile, dsize=(self.output_size, self.output_size),
+                interpolation=cv2.INTER_LINEAR)
+
+        if self.preprocess_fn is not None:
+            tile = self.preprocess_fn(tile)
+
+        return np.ascontiguousarray(tile, dtype=np.uint8)
+
+
+    def _put(self, tile_queue, item, stop):
+        while not stop.is_set():
+            try:
+                tile_queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+
+    def _reader_worker(self, coord_queue, tile_queue, stop):
+        slide = None
+        try:
+            slide = self._open_slide()
+            while not stop.is_set():
+                try:
+                    coord = coord_queue.get_nowait()
+                except queue.Empty:
+                    break
+                tile = self._read_tile(slide, coord)
+                self._put(tile_queue, (tile, np.array(coord, dtype=np.int64)), stop)
+        except Exception as e:
+            self._put(tile_queue, e, stop)
+        finally:
+            if slide is not None:
+                self._close_slide(slide)
+            self._put(tile_queue, None, stop)
 
 
     """ Create a dataset that knows what coordinates to feed
     it should exhaust itself after one time through the coordinates
+
+    Tiles come out in the order the readers finish them; use coord_op to place them.
     """
     def _generator(self):
-        pass
+        coord_queue = queue.Queue()
+        for coord in self.coords:
+            coord_queue.put(coord)
+
+        tile_queue = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+        workers = [threading.Thread(target=self._reader_worker,
+                       args=(coord_queue, tile_queue, stop))
+                   for _ in range(self.n_threads)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+
+        n_finished = 0
+        try:
+            while n_finished < len(workers):
+                item = tile_queue.get()
+                if item is None:
+                    n_finished += 1
+                    continue
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            ## Also reached when the iterator is re-initialized mid-slide
+            stop.set()
 
 
     def print_info(self):
+        print('-------------------- {} ---------------------- '.format(self.name))
+        for key, value in sorted(self.__dict__.items()):
+            if key in ['tissue_mask', 'foreground_index']:
+                print('|\t{}: {}'.format(key, value.shape))
+                continue
+            if key == 'coords':
+                print('|\t{}: [{} coordinates]'.format(key, len(value)))
+                continue
+            print('|\t{}: {}'.format(key, value))
+        print('-------------------- {} ---------------------- '.format(self.name))
+
+
+
+""" Low resolution RGB overview of a slide, longest side <= size """
+def get_thumbnail(slide, size):
+    if hasattr(slide, 'get_thumbnail'):
+        return np.array(slide.get_thumbnail((size, size)))[:, :, :3]
+
+    ## Fall back to reading the smallest level
+    level = slide.level_count - 1
+    thumbnail = np.array(slide.read_region((0, 0), level, slide.level_dimensions[level]))[:, :, :3]
+    scale = size / float(max(thumbnail.shape[:2]))
+    if scale < 1:
+        thumbnail = cv2.resize(thumbnail, dsize=(int(thumbnail.shape[1]*scale),
+            int(thumbnail.shape[0]*scale)), interpolation=cv2.INTER_AREA)
+    return thumbnail
+
+
+""" Boolean tissue mask from an RGB thumbnail
+
+H&E tissue is saturated while glass is near white, so Otsu's threshold on the
+HSV saturation channel separates the two. Closing fills small holes in the
+tissue, and opening removes dust and speckle.
+"""
+def find_tissue(thumbnail, kernel_size=5, min_saturation=20):
+    hsv = cv2.cvtColor(np.ascontiguousarray(thumbnail[:, :, :3], dtype=np.uint8), cv2.COLOR_RGB2HSV)
+    saturation = cv2.GaussianBlur(hsv[:, :, 1], (5, 5), 0)
+    otsu, _ = cv2.threshold(saturation, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    mask = (saturation > max(otsu, min_saturation)).astype(np.uint8)
+
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (kernel_size, kernel_size))
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+    return mask > 0
+
+
+"""
+Stand-in for openslide.OpenSlide backed by a numpy array or any image file cv2 can
+read (e.g. TIFF). Lower levels are built by 2x downsampling. Useful for testing
+SVSFeeder without a scanner file:
+
+    slide = NumpySlide(cv2.imread('tile.tif')[:,:,::-1], level_count=3)
+    feeder = SVSFeeder(svsfile=slide, level=1, tile_size=256)
+"""
+class NumpySlide(object):
+    def __init__(self, image, level_count=3):
+        if not isinstance(image, np.ndarray):
+            image = cv2.imread(image, -1)[:, :, 2::-1]
+        if len(image.shape) == 2:
+            image = np.stack([image]*3, axis=-1)
+
+        self.levels = [image]
+        for _ in range(1, level_count):
+            prev = self.levels[-1]
+            if min(prev.shape[:2]) < 2:
+                break
+            self.levels.append(cv2.resize(prev, dsize=(prev.shape[1]//2, prev.shape[0]//2),
+                interpolation=cv2.INTER_AREA))
+
+        self.level_count = len(self.levels)
+        self.level_dimensions = tuple((lvl.shape[1], lvl.shape[0]) for lvl in self.levels)
+        self.dimensions = self.level_dimensions[0]
+        self.level_downsamples = tuple(self.dimensions[0] / float(dims[0])
+            for dims in self.level_dimensions)
+        self.properties = {}
+
+
+    """ location is (x, y) in level 0 pixels; size is (w, h) at level.
+    Like OpenSlide, returns RGBA with alpha=0 past the slide border """
+    def read_region(self, location, level, size):
+        downsample = self.level_downsamples[level]
+        x = int(location[0] / downsample)
+        y = int(location[1] / downsample)
+        w, h = size
+
+        region = np.zeros((h, w, 4), dtype=np.uint8)
+        crop = self.levels[level][y:y+h, x:x+w, :3]
+        region[:crop.shape[0], :crop.shape[1], :3] = crop
+        region[:crop.shape[0], :crop.shape[1], 3] = 255
+        return region
+
+
+    def get_thumbnail(self, size):
+        thumbnail = self.levels[-1]
+        scale = min(size[0] / float(thumbnail.shape[1]), size[1] / float(thumbnail.shape[0]))
+        if scale < 1:
+            thumbnail = cv2.resize(thumbnail, dsize=(int(thumbnail.shape[1]*scale),
+                int(thumbnail.shape[0]*scale)), interpolation=cv2.INTER_AREA)
+        return thumbnail
+
+
+    def close(self):
         pass
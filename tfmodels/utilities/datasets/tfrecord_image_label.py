@@ -2,22 +2,25 @@ from __future__ import print_function
 import tensorflow as tf
 import numpy as np
 
+from .record_manifest import average_example_bytes, expand_records, record_format
+
 """
 TODO:
 https://www.tensorflow.org/programmers_guide/datasets#applying_arbitrary_python_logic_with_tfpy_func
 
-TODO:
-We can have multiple initialized datasets sitting around and feed the initializer
-into the placeholder via feed_dict:
-REF: https://github.com/tensorflow/tensorflow/blob/master/tensorflow/docs_src/programmers_guide/datasets.md
-
 TFRecordDataset(training_record = None,
     testing_record = None,
     crop_size = 512,
     ratio = 1.0,
     batch_size = 32,
-    prefetch = 1000,
+    compression = None,
+    encoding = None,
+    map_and_batch = True,
+    prefetch_batches = None,
+    prefetch_bytes = 256 * 2**20,
     shuffle_buffer = 512,
+    shuffle_bytes = None,
+    n_readers = 4,
     n_threads = 4,
     sess = None,
     as_onehot = True,
@@ -28,6 +31,26 @@ TFRecordDataset(training_record = None,
     preprocess = ['brightness', 'hue', 'saturation', 'contrast'],
     name = 'TFRecordDataset' )
 
+encoding ('raw', 'png' or 'jpeg') and compression (None, 'GZIP' or 'ZLIB') are read
+from the record's manifest when not given; records without a manifest are raw.
+
+training_record and testing_record may each be a file, a glob, a manifest, or a list
+(see record_manifest). Shards are visited in random order, n_readers at a time, and
+their examples interleaved.
+
+Training and testing files each get their own pipeline and iterator, initialized
+once. image_op and label_op come from a feedable iterator whose string handle is held
+in a variable outside every collection; switching phase only assigns the other
+iterator's handle, so both keep their shuffle buffers and prefetched batches warm,
+and the graph needs no feed_dict to pick the phase.
+REF: https://www.tensorflow.org/programmers_guide/datasets#creating_an_iterator
+
+Serialized examples are shuffled, then decoded and batched (fused with map_and_batch
+by default), and whole batches are prefetched. prefetch_batches counts batches; left as None
+it is set to hold about prefetch_bytes of output. The old `prefetch` argument
+counted examples and is ignored with a warning. shuffle_bytes, if given, sizes the
+shuffle buffer from the manifest's average example size instead of shuffle_buffer.
+
 
 """
 class TFRecordImageLabel(object):
@@ -37,8 +60,14 @@ class TFRecordImageLabel(object):
                     'crop_size': 512,
                     'ratio': 1.0,
                     'batch_size': 32,
-                    'prefetch': 1000,
+                    'compression': None,
+                    'encoding': None,
+                    'map_and_batch': True,
+                    'prefetch_batches': None,
+                    'prefetch_bytes': 256 * 2**20,
                     'shuffle_buffer': 512,
+                    'shuffle_bytes': None,
+                    'n_readers': 4,
                     'n_threads': 4,
                     'sess': None,
                     'as_onehot': True,
@@ -49,6 +78,9 @@ class TFRecordImageLabel(object):
                     'name': 'TFRecordImageLabel'
         }
         img_label_defaults.update(kwargs)
+        if 'prefetch' in kwargs:
+            print('WARNING {} ignores prefetch={}; it counted examples, use prefetch_batches or prefetch_bytes'.format(
+                img_label_defaults['name'], img_label_defaults.pop('prefetch')))
 
         for key,val in img_label_defaults.items():
             setattr(self, key, val)
@@ -57,18 +89,38 @@ class TFRecordImageLabel(object):
         assert self.n_classes is not None
 
         self.initialized = False
-
-        self.record_path = tf.placeholder_with_default(self.training_record, shape=())
-        self.dataset = (tf.data.TFRecordDataset(self.record_path)
-                        .repeat()
-                        .shuffle(buffer_size=self.shuffle_buffer)
-                        .map(lambda x: self._preprocessing(x, self.crop_size, self.ratio),
-                            num_parallel_calls=self.n_threads)
-                        .prefetch(buffer_size=self.batch_size)
-                        .batch(self.batch_size)
-                        )
-
-        self.iterator = self.dataset.make_initializable_iterator()
+        record_encoding, record_compression = record_format(self.training_record)
+        if self.encoding is None:
+            self.encoding = record_encoding
+        if self.compression is None:
+            self.compression = record_compression
+
+        self._buffer_sizes()
+
+        self.training_files = expand_records(self.training_record)
+        if self.testing_record is not None:
+            self.testing_files = expand_records(self.testing_record)
+        else:
+            self.testing_files = None
+
+        self.dataset = self._make_dataset(self.training_files)
+        self.training_iterator = self.dataset.make_initializable_iterator()
+        if self.testing_files is not None:
+            self.testing_dataset = self._make_dataset(self.testing_files)
+            self.testing_iterator = self.testing_dataset.make_initializable_iterator()
+        else:
+            self.testing_iterator = None
+
+        ## The active phase's string handle. Kept out of every collection so neither
+        ## global nor local variable initializers reset it; set_handle_op initializes it
+        self.handle = tf.Variable('', trainable=False, collections=[],
+            name='{}_handle'.format(self.name))
+        self.handle_in = tf.placeholder(tf.string, shape=[])
+        self.set_handle_op = tf.assign(self.handle, self.handle_in)
+        self.handles = {}
+
+        self.iterator = tf.data.Iterator.from_string_handle(self.handle,
+            self.dataset.output_types, self.dataset.output_shapes)
         self.image_op, self.label_op = self.iterator.get_next()
 
         if self.sess is not None:
@@ -76,21 +128,66 @@ class TFRecordImageLabel(object):
 
 
     def _initalize_training(self, sess):
-        fd = {self.record_path: self.training_record}
-        _ = sess.run([self.iterator.initializer], feed_dict=fd)
-        # sess.run(self.iterator.initializer, feed_dict=fd)
-        self.phase = 'TRAIN'
+        self._select_iterator(sess, 'TRAIN', self.training_iterator)
         print('Dataset TRAINING phase')
 
 
     def _initalize_testing(self, sess):
-        fd = {self.record_path: self.testing_record}
-        _ = sess.run([self.iterator.initializer], feed_dict=fd)
-        # sess.run(self.iterator.initializer, feed_dict=fd)
-        self.phase = 'TEST'
+        if self.testing_record is None:
+            print('WARNING DATSET {} HAS NO TEST RECORD'.format(self.name))
+            return
+        self._select_iterator(sess, 'TEST', self.testing_iterator)
         print('Dataset TESTING phase')
 
 
+    """ Point the feedable iterator at `iterator`, initializing it on first use
+    only. Handles are only valid in the session that made them """
+    def _select_iterator(self, sess, phase, iterator):
+        if (sess, phase) not in self.handles:
+            sess.run(iterator.initializer)
+            self.handles[(sess, phase)] = sess.run(iterator.string_handle())
+        sess.run(self.set_handle_op, feed_dict={self.handle_in: self.handles[(sess, phase)]})
+        self.phase = phase
+
+
+    """ Shuffled, repeated, decoded and batched examples from `files` """
+    def _make_dataset(self, files):
+        record_files = (tf.data.Dataset.from_tensor_slices(files)
+                        .shuffle(buffer_size=len(files))
+                        .repeat() )
+        examples = (record_files.apply(tf.contrib.data.parallel_interleave(
+                            lambda path: tf.data.TFRecordDataset(path,
+                                compression_type=self.compression),
+                            cycle_length=self.n_readers, sloppy=True))
+                        .shuffle(buffer_size=self.shuffle_buffer) )
+
+        preprocess_fn = lambda x: self._preprocessing(x, self.crop_size, self.ratio)
+        if self.map_and_batch:
+            batches = examples.apply(tf.contrib.data.map_and_batch(preprocess_fn,
+                self.batch_size, num_parallel_calls=self.n_threads))
+        else:
+            batches = (examples.map(preprocess_fn, num_parallel_calls=self.n_threads)
+                       .batch(self.batch_size))
+        return batches.prefetch(buffer_size=self.prefetch_batches)
+
+
+    """ Buffer sizes in elements; see the module docstring """
+    def _buffer_sizes(self):
+        out_size = int(self.crop_size * self.ratio)
+        out_channels = self.img_channels
+        batch_bytes = self.batch_size * out_size * out_size * out_channels * 4
+        if self.prefetch_batches is None:
+            self.prefetch_batches = max(1, int(self.prefetch_bytes // batch_bytes))
+
+        if self.shuffle_bytes is not None:
+            example_bytes = average_example_bytes(self.training_record)
+            if example_bytes is None:
+                print('WARNING no manifest for {}; using shuffle_buffer={}'.format(
+                    self.training_record, self.shuffle_buffer))
+            else:
+                self.shuffle_buffer = max(1, int(self.shuffle_bytes // example_bytes))
+
+
     def print_info(self):
         print('-------------------- {} ---------------------- '.format(self.name))
         for key, value in sorted(self.__dict__.items()):
@@ -98,38 +195,53 @@ class TFRecordImageLabel(object):
         print('-------------------- {} ---------------------- '.format(self.name))
 
 
-    def _decode(self, example):
+    """ Random [crop_size, crop_size] window inside an (h, w) image; returns (y, x) offsets """
+    def _crop_offsets(self, h, w, crop_size):
+        y = tf.random_uniform([], maxval=h - crop_size + 1, dtype=tf.int32)
+        x = tf.random_uniform([], maxval=w - crop_size + 1, dtype=tf.int32)
+        return y, x
+
+
+    """ Decode one example and return a random crop of the image, in its stored dtype,
+    and the label. JPEG images only decode the cropped window. """
+    def _decode(self, example, crop_size):
         features = {'height': tf.FixedLenFeature((), tf.int64, default_value=0),
                     'width': tf.FixedLenFeature((), tf.int64, default_value=0),
                     'img': tf.FixedLenFeature((), tf.string, default_value=''),
                     'y': tf.FixedLenFeature((), tf.int64, default_value=0), }
         pf = tf.parse_single_example(example, features)
 
-        height = tf.squeeze(pf['height'])
-        width = tf.squeeze(pf['width'])
+        height = tf.cast(tf.squeeze(pf['height']), tf.int32)
+        width = tf.cast(tf.squeeze(pf['width']), tf.int32)
         label = tf.squeeze(pf['y'])
+        y, x = self._crop_offsets(height, width, crop_size)
 
         img = pf['img']
-        img = tf.decode_raw(img, self.img_dtype)
+        if self.encoding == 'raw':
+            img = tf.reshape(tf.decode_raw(img, self.img_dtype),
+                tf.stack([height, width, self.img_channels], axis=0))
+        elif self.encoding == 'png':
+            img = tf.image.decode_png(img, channels=self.img_channels, dtype=self.img_dtype)
+        elif self.encoding == 'jpeg':
+            img = tf.image.decode_and_crop_jpeg(img, tf.stack([y, x, crop_size, crop_size]),
+                channels=self.img_channels)
+        else:
+            raise Exception('Unsupported record encoding {}'.format(self.encoding))
+
+        if self.encoding != 'jpeg':
+            img = tf.slice(img, tf.stack([y, x, 0]), [crop_size, crop_size, -1])
+        img.set_shape([crop_size, crop_size, self.img_channels])
 
-        img = tf.cast(img, tf.float32)
-        if self.as_onehot:
-            label = tf.one_hot(label, depth=self.n_classes)
-
-        return height, width, img, label
+        return img, label
 
 
+    """ Crop and flip in the stored dtype, then cast only the crop to float """
     def _preprocessing(self, example, crop_size, ratio):
-        h, w, img, label = self._decode(example)
-        img_shape = tf.stack([h, w, self.img_channels], axis=0)
-
-        img = tf.reshape(img, img_shape)
-
-        img = tf.random_crop(img,
-            [crop_size, crop_size, self.img_channels])
+        img, label = self._decode(example, crop_size)
         img = tf.image.random_flip_left_right(img)
         img = tf.image.random_flip_up_down(img)
 
+        img = tf.cast(img, tf.float32)
         for px in self.preprocess:
             if px == 'brightness':
                 img = tf.image.random_brightness(img, max_delta=0.05)
@@ -143,12 +255,14 @@ class TFRecordImageLabel(object):
             elif px == 'saturation':
                 img = tf.image.random_saturation(img, lower=0.7, upper=0.9)
 
-        target_h = tf.cast(crop_size*ratio, tf.int32)
-        target_w = tf.cast(crop_size*ratio, tf.int32)
-        img = tf.image.resize_images(img, [target_h, target_w])
+        if ratio != 1.0:
+            target_size = int(crop_size*ratio)
+            img = tf.image.resize_images(img, [target_size, target_size])
 
-        ## Recenter to [-0.5, 0.5] for SELU activations
-        # img = tf.cast(img, tf.float32)
+        ## Recenter to [-1, 1] for SELU activations
         img = tf.multiply(img, 2/255.0) - 1
 
+        if self.as_onehot:
+            label = tf.one_hot(label, depth=self.n_classes)
+
         return img, label
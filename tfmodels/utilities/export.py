@@ -0,0 +1,125 @@
+from __future__ import print_function
+import tensorflow as tf
+import json
+
+try:
+    from tensorflow.tools.graph_transforms import TransformGraph
+except ImportError:
+    TransformGraph = None
+
+"""
+Frozen inference graphs
+
+export_frozen_graph() rebuilds a model's forward pass in a clean graph with
+keep_prob=1.0 and training=False, so dropout and batch norm switches are
+resolved at build time, and no optimizer, summary, dataset or saver ops
+exist. Weights come from a snapshot, or from the live model's session. The
+variables are converted to constants, and where graph_transforms is available
+constants and batch norms are folded.
+
+    export_frozen_graph(model, 'densenet.pb', snapshot_path='snapshots/densenet.ckpt-10000')
+
+    frozen = FrozenModel('densenet.pb')
+    y_hat = frozen.inference(x)     ## (n, h, w, n_classes) softmax
+
+The graph has one input, `input` [None] + x_dims, and one output, `output`:
+the softmax for Segmentation / Classifier, or the raw prediction for Regression.
+Input and output names and x_dims are also written to <output_path>.json.
+
+Variables missing from the snapshot are listed and exported with their initial
+values. Snapshots from BaseModel's default Saver only hold trainable variables,
+so batch norm moving statistics are among them.
+"""
+
+TRANSFORMS = ['strip_unused_nodes',
+              'remove_nodes(op=Identity, op=CheckNumerics)',
+              'fold_constants(ignore_errors=true)',
+              'fold_batch_norms',
+              'fold_old_batch_norms']
+
+def _variable_values(model, variables, snapshot_path):
+    names = [var.op.name for var in variables]
+    if snapshot_path is not None:
+        reader = tf.train.NewCheckpointReader(snapshot_path)
+        stored = set(reader.get_variable_to_shape_map().keys())
+        return {name: reader.get_tensor(name) for name in names if name in stored}
+
+    source_vars = {var.op.name: var for var in model.sess.graph.get_collection(
+        tf.GraphKeys.GLOBAL_VARIABLES)}
+    found = [name for name in names if name in source_vars]
+    values = model.sess.run([source_vars[name] for name in found])
+    return dict(zip(found, values))
+
+
+def export_frozen_graph(model, output_path, snapshot_path=None, output=None,
+    transforms=TRANSFORMS):
+    if output is None:
+        output = 'softmax' if hasattr(model, 'y_hat_smax') else 'linear'
+
+    graph = tf.Graph()
+    with graph.as_default():
+        x_in = tf.placeholder(tf.float32, shape=[None] + list(model.x_dims), name='input')
+        y_hat = model.model(x_in, keep_prob=1.0, reuse=False, training=False)
+        if isinstance(y_hat, (list, tuple)):
+            ## SegmentationBayesian returns (y_hat, sigma)
+            y_hat = y_hat[0]
+        if output == 'softmax':
+            y_hat = tf.nn.softmax(y_hat, name='output')
+        else:
+            y_hat = tf.identity(y_hat, name='output')
+
+        variables = tf.global_variables()
+        values = _variable_values(model, variables, snapshot_path)
+        missing = [var.op.name for var in variables if var.op.name not in values]
+        if len(missing) > 0:
+            print('WARNING {} variables not found; exporting their initial values:'.format(len(missing)))
+            for name in missing:
+                print('\t', name)
+
+        with tf.Session(graph=graph) as sess:
+            sess.run(tf.global_variables_initializer())
+            for var in variables:
+                if var.op.name in values:
+                    var.load(values[var.op.name], sess)
+
+            graph_def = tf.graph_util.convert_variables_to_constants(sess,
+                graph.as_graph_def(), ['output'])
+
+    graph_def = tf.graph_util.remove_training_nodes(graph_def, protected_nodes=['input', 'output'])
+    if TransformGraph is not None and transforms:
+        graph_def = TransformGraph(graph_def, ['input'], ['output'], transforms)
+    else:
+        print('graph_transforms unavailable; skipping constant and batch norm folding')
+
+    with tf.gfile.GFile(output_path, 'wb') as f:
+        f.write(graph_def.SerializeToString())
+    with open(output_path + '.json', 'w') as f:
+        json.dump({'input': 'input:0', 'output': 'output:0', 'x_dims': list(model.x_dims),
+                   'output_type': output, 'name': model.name}, f, indent=2)
+
+    print('Exported {} ({} nodes) to {}'.format(model.name, len(graph_def.node), output_path))
+    return output_path
+
+
+""" Load and run a graph written by export_frozen_graph """
+class FrozenModel(object):
+    def __init__(self, graph_path, input_name='input:0', output_name='output:0', config=None):
+        graph_def = tf.GraphDef()
+        with tf.gfile.GFile(graph_path, 'rb') as f:
+            graph_def.ParseFromString(f.read())
+
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            tf.import_graph_def(graph_def, name='')
+        self.x_in = self.graph.get_tensor_by_name(input_name)
+        self.y_hat = self.graph.get_tensor_by_name(output_name)
+        self.x_dims = self.x_in.get_shape().as_list()[1:]
+        self.sess = tf.Session(graph=self.graph, config=config)
+
+
+    def inference(self, x_in):
+        return self.sess.run(self.y_hat, feed_dict={self.x_in: x_in})
+
+
+    def close(self):
+        self.sess.close()
@@ -5,8 +5,12 @@ import numpy as np
 import cv2
 import os, glob, sys, shutil
 import datetime, time
+import multiprocessing
 
 from datasets import TFRecordImageMask
+from .datasets.record_manifest import shard_paths, write_manifest
+from .stats import RunningMoments
+from .tiling import tile_coordinates
 
 
 """ Save a 4D stack of images """
@@ -43,22 +47,17 @@ def bayesian_inference(model, x_in, samples, keep_prob=0.5, verbose=False):
     if verbose:
         print('Entering ops.bayesian_inference() with {} samples'.format(samples))
         print('Got x_in: {} [{}-{}]'.format(x_in.shape, x_in.min(), x_in.max()))
-        print('initializing y_hat')
 
-    y_hat = model.inference(x_in=x_in, keep_prob=keep_prob)
-    y_hat = np.expand_dims(y_hat, -1)
-    if verbose:
-        print('y_hat initialized: {}'.format(y_hat.shape))
-
-    for tt in xrange(1, samples):
+    ## Streaming mean / variance; samples are never held all at once
+    moments = RunningMoments()
+    for tt in xrange(samples):
         y_hat_p = model.inference(x_in=x_in, keep_prob=keep_prob)
-        y_hat = np.concatenate([y_hat, np.expand_dims(y_hat_p, -1)], -1)
+        moments.update_one(y_hat_p)
 
     if verbose:
-        print('y_hat_i: {}'.format(y_hat.shape))
         print('finding means, variance and argmax')
-    y_bar_mean = np.mean(y_hat, axis=-1)
-    y_bar_var = np.var(y_hat, axis=-1)
+    y_bar_mean = moments.mean
+    y_bar_var = moments.variance
     y_bar = np.argmax(y_bar_mean, axis=-1) ## (1, h, w)
 
     if verbose:
@@ -110,7 +109,7 @@ Numpy arrays are iterable along the first dimension
 def test_bayesian_inference(model, test_x_list, output_dir, prefix='', keep_prob=0.5, samples=50):
     for test_idx, test_img in enumerate(test_x_list):
         test_img = np.expand_dims(test_img, 0)
-        y_bar_mean, y_bar_var = model.bayesian_inference(test_img,
+        y_bar_mean, y_bar_var, _ = model.bayesian_inference(test_img,
             samples, keep_prob=keep_prob, ret_all=True)
         y_bar = np.argmax(y_bar_mean, axis=-1)
         y_bar = np.expand_dims(y_bar, 0)
@@ -142,11 +141,11 @@ def _cut_subimages(img, subimage_size, oversample_factor):
 
     hT = h / float(subimage_size)
     wT = w / float(subimage_size)
+    n_tiles = [int(np.ceil(hT)*oversample_factor), int(np.ceil(wT)*oversample_factor)]
 
     subimgs = []
-    for ih in np.linspace(0, h-subimage_size, int(np.ceil(hT)*oversample_factor), dtype=np.int):
-        for iw in np.linspace(0, w-subimage_size, int(np.ceil(wT)*oversample_factor), dtype=np.int):
-            subimgs.append(img[ih:ih+subimage_size, iw:iw+subimage_size])
+    for ih, iw in tile_coordinates(h, w, subimage_size, n_tiles=n_tiles):
+        subimgs.append(img[ih:ih+subimage_size, iw:iw+subimage_size])
 
     return subimgs
 
@@ -178,62 +177,50 @@ def estimate_dataset_size(img_path, mask_path, n_classes, n_examples):
 
     return (img_.nbytes + mask_.nbytes) * n_examples
 
-"""
-TODO
-Add option to split several records after shuffling to help distributed training
-During training we'll have to switch the active dataset with a placeholder
-that feeds initialized datasets
-
-(REF: https://github.com/tensorflow/tensorflow/blob/master/tensorflow/docs_src/programmers_guide/datasets.md)
+def _bgr_to_rgb(img):
+    return img[:,:,::-1]
 
-1. Estimate the dataset size
-2. Shuffle the file handles
-3. Split it into sizable chunks
-4. Save them
 
-Note: via the subimage_size argument this function is set up to handle
-variable sized inputs, and normalize them to subimages with uniform size
-"""
-def image_mask_2_tfrecord(img_patt, mask_patt, record_path, img_process_fn=lambda x: x[:,:,::-1],
-    mask_process_fn=None, name_transl_fn=None, n_classes=None, subimage_size=None,
-    oversample_factor=1.2):
+""" PNG/JPEG bytes of an RGB(A) or single channel array. cv2 expects BGR order """
+def _encode_array(arr, encoding):
+    if len(arr.shape) == 3 and arr.shape[-1] in [3, 4]:
+        arr = np.concatenate([arr[:,:,2::-1], arr[:,:,3:]], axis=-1)
+    ext = {'png': '.png', 'jpeg': '.jpg'}[encoding]
+    success, buf = cv2.imencode(ext, arr)
+    assert success, 'Failed to encode array {} {} as {}'.format(arr.shape, arr.dtype, encoding)
+    return buf.tobytes()
 
-    writer = tf.python_io.TFRecordWriter(record_path)
 
-    # img_list = sorted(glob.glob(os.path.join(img_path, '*'+img_ext)))
-    # mask_list = sorted(glob.glob(os.path.join(mask_path, '*'+mask_ext)))
-    img_list = sorted(glob.glob(img_patt))
-    mask_list = sorted(glob.glob(mask_patt))
+""" encoding='raw' stores pixel buffers; 'png' or 'jpeg' stores encoded images.
+Masks are always stored losslessly as PNG when encoded. """
+def _image_mask_example(img, mask, height, width, encoding='raw'):
+    if encoding == 'raw':
+        img_raw = img.tobytes()
+        mask_raw = mask.tobytes()
+    else:
+        img_raw = _encode_array(img, encoding)
+        mask_raw = _encode_array(mask, 'png')
+    example = tf.train.Example(features=tf.train.Features(feature={
+        'height': _int64_feature(height),
+        'width': _int64_feature(width),
+        'img': _bytes_feature(img_raw),
+        'mask': _bytes_feature(mask_raw) }))
+    return example.SerializeToString()
 
-    if name_transl_fn is None:
-        ## We're relying on our past selves to have not messed up
-        assert len(img_list) == len(mask_list)
-        assert len(img_list) > 0
-    print('Got {} source images'.format(len(img_list)))
-    # estimated_size = estimate_dataset_size(img_list[0], mask_list[0], n_classes)
 
-    ## Shuffle and subset
-    tmp_list = zip(img_list, mask_list)
-    np.random.shuffle(tmp_list)
-    # tmp_list = tmp_list[:min(len(tmp_list), 50)]
-    img_list, mask_list = zip(*tmp_list)
+_COMPRESSION_TYPES = {None: tf.python_io.TFRecordCompressionType.NONE,
+                      'GZIP': tf.python_io.TFRecordCompressionType.GZIP,
+                      'ZLIB': tf.python_io.TFRecordCompressionType.ZLIB}
 
-    count = 0
-    for source_idx, (imgp, maskp) in enumerate(zip(img_list, mask_list)):
-        imgbase = os.path.basename(imgp)
-        ## Overwrite mask_list... this is bad bad bad
-        if name_transl_fn is not None:
-            maskp = name_transl_fn(imgp)
-            mask_exists = os.path.exists(maskp)
-            if not mask_exists:
-                print('WARRNING!! Image {} no matching mask {}'.format(imgp, maskp))
-                continue
-        maskbase = os.path.basename(maskp)
 
-        imgbase = os.path.splitext(imgbase)[0]
-        maskbase = os.path.splitext(maskbase)[0]
+""" Write one shard from a list of (image, mask) paths; returns its manifest entry """
+def _write_image_mask_shard(shard_path, pairs, img_process_fn=None, mask_process_fn=None,
+    subimage_size=None, oversample_factor=1.2, encoding='raw', compression=None):
+    options = tf.python_io.TFRecordOptions(_COMPRESSION_TYPES[compression])
+    writer = tf.python_io.TFRecordWriter(shard_path, options=options)
 
-        # print imgbase, maskbase
+    count = 0
+    for source_idx, (imgp, maskp) in enumerate(pairs):
         ## TODO (nathan) check image-masks combos -- names should match
         img, mask, height, width = _read_img_mask(imgp, maskp,
             img_process_fn=img_process_fn,
@@ -243,39 +230,142 @@ def image_mask_2_tfrecord(img_patt, mask_patt, record_path, img_process_fn=lambd
 
         if subimage_size is not None:
             for img_, mask_ in zip(img, mask):
-                img_raw = img_.tostring()
-                mask_raw = mask_.tostring()
-                example = tf.train.Example(features=tf.train.Features(feature={
-                    'height': _int64_feature(subimage_size),
-                    'width': _int64_feature(subimage_size),
-                    'img': _bytes_feature(img_raw),
-                    'mask': _bytes_feature(mask_raw) }))
-                writer.write(example.SerializeToString())
+                writer.write(_image_mask_example(img_, mask_, subimage_size, subimage_size,
+                    encoding=encoding))
                 count += 1
                 if count % 100 == 0:
                     print('Writing [{}] image [{:05d}] (source [{:05d}]/[{:05d}])'.format(
-                        record_path, count, source_idx, len(img_list)))
+                        shard_path, count, source_idx, len(pairs)))
         else:
-            img_raw = img.tostring()
-            mask_raw = mask.tostring()
-            example = tf.train.Example(features=tf.train.Features(feature={
-                'height': _int64_feature(height),
-                'width': _int64_feature(width),
-                'img': _bytes_feature(img_raw),
-                'mask': _bytes_feature(mask_raw) }))
-            writer.write(example.SerializeToString())
+            writer.write(_image_mask_example(img, mask, height, width, encoding=encoding))
             count += 1
             if count % 100 == 0:
                 print('Writing [{}] image [{:05d}]/[{:05d}]'.format(
-                    record_path, count, len(img_list)))
+                    shard_path, count, len(pairs)))
 
     writer.close()
-    print('Finished writing [{}]'.format(record_path))
+    print('Finished writing [{}]'.format(shard_path))
+    return {'path': shard_path,
+            'n_examples': count,
+            'n_bytes': os.path.getsize(shard_path),
+            'n_sources': len(pairs)}
+
+
+## Shard jobs for worker processes. Set before the pool forks so that
+## user supplied functions (often lambdas) never have to be pickled.
+_SHARD_JOBS = None
+
+def _write_shard_job(shard_idx):
+    shard_path, pairs, kwargs = _SHARD_JOBS[shard_idx]
+    return _write_image_mask_shard(shard_path, pairs, **kwargs)
+
+
+""" Split (image, mask) pairs into n_shards with about the same number of source bytes
+
+Longest-processing-time: biggest files first, each to the currently lightest shard.
+Each shard is shuffled afterwards.
+"""
+def _balance_shards(pairs, n_shards):
+    sizes = [os.path.getsize(imgp) for imgp, _ in pairs]
+    shards = [[] for _ in range(n_shards)]
+    loads = np.zeros(n_shards)
+    for idx in np.argsort(sizes)[::-1]:
+        target = np.argmin(loads)
+        shards[target].append(pairs[idx])
+        loads[target] += sizes[idx]
+
+    for shard in shards:
+        np.random.shuffle(shard)
+    return shards
+
+
+"""
+Convert image / mask pairs into tfrecords
+
+Source pairs are shuffled and split into `n_shards` records of balanced size,
+written by `n_workers` processes. Shards are named like
+    record-00000-of-00004.tfrecord
+(with n_shards=1 the single record is written to record_path as before.)
+A manifest, record.manifest.json, lists per-shard example counts and byte sizes;
+it can be passed to TFRecordImageMask as the record.
+
+encoding: 'raw' pixel buffers (default), or 'png' / 'jpeg' encoded images.
+    Encoded records are several times smaller; masks are always stored as PNG.
+compression: None, 'GZIP' or 'ZLIB' record compression.
+Both are saved in the manifest, which the dataset classes use to pick a decoder.
+
+Workers are forked, so img_process_fn, mask_process_fn and name_transl_fn
+need not be picklable.
+
+Note: via the subimage_size argument this function is set up to handle
+variable sized inputs, and normalize them to subimages with uniform size
+"""
+def image_mask_2_tfrecord(img_patt, mask_patt, record_path, img_process_fn=_bgr_to_rgb,
+    mask_process_fn=None, name_transl_fn=None, n_classes=None, subimage_size=None,
+    oversample_factor=1.2, n_shards=1, n_workers=1, encoding='raw', compression=None):
+    global _SHARD_JOBS
+    assert encoding in ['raw', 'png', 'jpeg']
+    assert compression in _COMPRESSION_TYPES
+
+    # img_list = sorted(glob.glob(os.path.join(img_path, '*'+img_ext)))
+    # mask_list = sorted(glob.glob(os.path.join(mask_path, '*'+mask_ext)))
+    img_list = sorted(glob.glob(img_patt))
+    mask_list = sorted(glob.glob(mask_patt))
+
+    if name_transl_fn is None:
+        ## We're relying on our past selves to have not messed up
+        assert len(img_list) == len(mask_list)
+        assert len(img_list) > 0
+    print('Got {} source images'.format(len(img_list)))
+
+    pairs = []
+    for imgp, maskp in zip(img_list, mask_list):
+        ## Overwrite mask_list... this is bad bad bad
+        if name_transl_fn is not None:
+            maskp = name_transl_fn(imgp)
+            if not os.path.exists(maskp):
+                print('WARRNING!! Image {} no matching mask {}'.format(imgp, maskp))
+                continue
+        pairs.append((imgp, maskp))
+
+    ## Shuffle and split
+    np.random.shuffle(pairs)
+    n_shards = min(n_shards, len(pairs))
+    shard_pairs = _balance_shards(pairs, n_shards) if n_shards > 1 else [pairs]
+    shard_kwargs = {'img_process_fn': img_process_fn,
+                    'mask_process_fn': mask_process_fn,
+                    'subimage_size': subimage_size,
+                    'oversample_factor': oversample_factor,
+                    'encoding': encoding,
+                    'compression': compression}
+    _SHARD_JOBS = [(path, shard, shard_kwargs)
+                   for path, shard in zip(shard_paths(record_path, n_shards), shard_pairs)]
+
+    n_workers = min(n_workers, n_shards)
+    try:
+        if n_workers > 1:
+            pool = multiprocessing.Pool(n_workers)
+            try:
+                shards = pool.map(_write_shard_job, range(n_shards))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            shards = [_write_shard_job(idx) for idx in range(n_shards)]
+    finally:
+        _SHARD_JOBS = None
+
+    return write_manifest(record_path, shards,
+        n_classes=n_classes,
+        subimage_size=subimage_size,
+        encoding=encoding,
+        compression=compression,
+        created=datetime.datetime.now().strftime("%Y_%m_%d_%H_%M_%S"))
 
 
 
 def check_tfrecord(record_path, iterations=25, crop_size=512, image_ratio=0.5,
-    batch_size=32, prefetch=5000, n_threads=4, as_onehot=True, n_classes=None,
+    batch_size=32, prefetch_batches=None, n_threads=4, as_onehot=True, n_classes=None,
     img_dtype=tf.uint8, mask_dtype=tf.uint8, img_channels=3, mask_channels=1, preprocess=[]):
     with tf.Session() as sess:
         dataset = TFRecordImageMask(
@@ -285,7 +375,7 @@ def check_tfrecord(record_path, iterations=25, crop_size=512, image_ratio=0.5,
             crop_size = crop_size,
             ratio = image_ratio,
             batch_size = batch_size,
-            prefetch = prefetch,
+            prefetch_batches = prefetch_batches,
             n_threads = n_threads,
             img_dtype = img_dtype,
             mask_dtype = mask_dtype,
@@ -307,8 +397,9 @@ def check_tfrecord(record_path, iterations=25, crop_size=512, image_ratio=0.5,
     print('Average time:', np.mean(pull_times))
 
 
-""" Same as above; except use a dataset defined externally. """
-def check_tfrecord_dataset(dataset, iterations=25):
+""" Same as above; except use a dataset defined externally.
+For throughput over a grid of settings see utilities/benchmark.py """
+def check_tfrecord_dataset(dataset, sess, iterations=25):
     pull_times = []
     print('Checking average load time for {} batches'.format(iterations))
     for _ in xrange(iterations):
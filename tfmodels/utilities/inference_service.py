@@ -0,0 +1,180 @@
+from __future__ import print_function
+import numpy as np
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+"""
+Micro-batched inference shared by many caller threads
+
+Callers submit single examples and get a future back. Worker threads gather
+queued examples into batches of up to max_batch_size, waiting at most
+max_wait seconds after the first example of a batch, run one predict call per
+batch and hand each caller its slice of the output.
+
+    service = BatchedInferenceService(model, max_batch_size=32, max_wait=0.005)
+    future = service.submit(tile)          ## tile: one example, e.g. (h, w, c)
+    y_hat = future.result()                ## model output for that tile
+    ...
+    print(service.metrics())
+    service.close()
+
+`model` is anything with an inference(x_in) method taking a batch (Segmentation,
+Regression, Classifier, FrozenModel), or a function of a batch.
+"""
+
+class InferenceFuture(object):
+    def __init__(self):
+        self._event = threading.Event()
+        self._result = None
+        self._error = None
+
+
+    def set_result(self, result):
+        self._result = result
+        self._event.set()
+
+
+    def set_exception(self, error):
+        self._error = error
+        self._event.set()
+
+
+    def done(self):
+        return self._event.is_set()
+
+
+    def result(self, timeout=None):
+        if not self._event.wait(timeout):
+            raise Exception('Inference result not ready after {}s'.format(timeout))
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class BatchedInferenceService(object):
+    def __init__(self, model, max_batch_size=32, max_wait=0.005, n_workers=1,
+        capacity=1024, name='BatchedInferenceService'):
+        self.predict_fn = model.inference if hasattr(model, 'inference') else model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.name = name
+
+        self.queue = queue.Queue(maxsize=capacity)
+        self.lock = threading.Lock()
+        self.n_batches = 0
+        self.n_examples = 0
+        self.run_time = 0.
+        self.wait_time = 0.
+        self.batch_sizes = np.zeros(max_batch_size + 1, dtype=np.int64)
+
+        ## Held across submit's stop check and put, and while close() sets stop,
+        ## so nothing can be queued after close() has started
+        self.submit_lock = threading.Lock()
+        self.stop = threading.Event()
+        self.workers = [threading.Thread(target=self._worker, name='{}_{}'.format(name, idx))
+                        for idx in range(n_workers)]
+        for worker in self.workers:
+            worker.daemon = True
+            worker.start()
+
+
+    """ Queue one example; blocks only if `capacity` requests are already waiting """
+    def submit(self, x):
+        future = InferenceFuture()
+        with self.submit_lock:
+            if self.stop.is_set():
+                raise Exception('{} is closed'.format(self.name))
+            self.queue.put((np.asarray(x), future, time.time()))
+        return future
+
+
+    def predict(self, x, timeout=None):
+        return self.submit(x).result(timeout)
+
+
+    def metrics(self):
+        with self.lock:
+            n_batches = max(self.n_batches, 1)
+            n_examples = max(self.n_examples, 1)
+            return {'queue_depth': self.queue.qsize(),
+                    'batches': self.n_batches,
+                    'examples': self.n_examples,
+                    'mean_batch_size': self.n_examples / float(n_batches),
+                    'batch_fill': self.n_examples / float(n_batches * self.max_batch_size),
+                    'batch_size_hist': self.batch_sizes.tolist(),
+                    'mean_run_ms': 1000. * self.run_time / n_batches,
+                    'mean_queue_wait_ms': 1000. * self.wait_time / n_examples}
+
+
+    """ Stop the workers; requests still queued fail instead of waiting forever """
+    def close(self):
+        ## A submit blocked on a full queue holds the lock; the workers are still
+        ## running, so its put completes and that request is drained below
+        with self.submit_lock:
+            self.stop.set()
+        for worker in self.workers:
+            worker.join()
+
+        while True:
+            try:
+                _, future, _ = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            future.set_exception(Exception('{} closed before the request ran'.format(self.name)))
+
+
+    """ Block for the first request, then take more until the batch is full or max_wait passes """
+    def _gather(self):
+        while not self.stop.is_set():
+            try:
+                first = self.queue.get(timeout=0.1)
+                break
+            except queue.Empty:
+                continue
+        else:
+            return []
+
+        batch = [first]
+        deadline = time.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.time()
+            try:
+                if remaining > 0:
+                    batch.append(self.queue.get(timeout=remaining))
+                else:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+
+    def _worker(self):
+        while not self.stop.is_set():
+            batch = self._gather()
+            if len(batch) == 0:
+                continue
+
+            tstart = time.time()
+            try:
+                y_hat = self.predict_fn(np.stack([x for x, _, _ in batch], axis=0))
+                for idx, (_, future, _) in enumerate(batch):
+                    ## SegmentationBayesian returns (y_hat, sigma)
+                    if isinstance(y_hat, (list, tuple)):
+                        future.set_result(tuple(y[idx] for y in y_hat))
+                    else:
+                        future.set_result(y_hat[idx])
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+
+            with self.lock:
+                self.n_batches += 1
+                self.n_examples += len(batch)
+                self.batch_sizes[len(batch)] += 1
+                self.run_time += time.time() - tstart
+                self.wait_time += sum(tstart - queued for _, _, queued in batch)
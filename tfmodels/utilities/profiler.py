@@ -0,0 +1,168 @@
+from __future__ import print_function
+import tensorflow as tf
+import numpy as np
+import collections
+import contextlib
+import os
+import time
+
+from tensorflow.python.client import timeline
+
+"""
+Per-step timing for training loops
+
+Time spent in a step is split into named phases:
+
+    profiler.run(sess, fetches)            -> 'compute'
+    with profiler.phase('input'): ...      -> any named phase
+    profiler.end_step(step, n_examples)    -> closes the step
+
+Phases timed between two end_step() calls (e.g. a snapshot between steps)
+are charged to the next step. Every report_every steps the rolling means over
+the last `window` steps are written as `profile/` summaries: milliseconds per
+phase, total step time, and examples/s.
+
+With trace_every > 0, every trace_every'th step's sess.run is traced with
+FULL_TRACE and saved at end_step to trace_dir/timeline_<global_step>_<phase>.json,
+which loads in chrome://tracing. Steps with several runs (e.g. WGAN critic
+updates) pass trace=False to all but the run worth tracing. Time spent in
+IteratorGetNext ops on traced runs is reported as the 'input_wait' phase, the
+only way to see input stalls inside a graph fed by tf.data.
+
+NullProfiler has the same interface and does no work; BaseModel uses it
+unless profile=True.
+"""
+
+class StepProfiler(object):
+    def __init__(self, summary_writer=None, trace_dir=None, trace_every=0,
+        report_every=50, window=100, name='StepProfiler'):
+        self.summary_writer = summary_writer
+        self.trace_dir = trace_dir
+        self.trace_every = trace_every
+        self.report_every = report_every
+        self.window = window
+        self.name = name
+
+        self.history = collections.defaultdict(lambda: collections.deque(maxlen=window))
+        self.current = collections.defaultdict(float)
+        self.n_steps = 0
+        self.step_start = time.time()
+        self.pending_traces = []
+
+        if self.trace_dir is not None and not os.path.exists(self.trace_dir):
+            os.makedirs(self.trace_dir)
+
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        tstart = time.time()
+        try:
+            yield
+        finally:
+            self.current[name] += time.time() - tstart
+
+
+    """ sess.run timed as `phase`, traced every trace_every steps unless trace=False """
+    def run(self, sess, fetches, feed_dict=None, phase='compute', trace=True):
+        step = self.n_steps + 1
+        trace = (trace and self.trace_every > 0 and self.trace_dir is not None
+                 and step % self.trace_every == 0)
+        if not trace:
+            with self.phase(phase):
+                return sess.run(fetches, feed_dict=feed_dict)
+
+        run_options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+        run_metadata = tf.RunMetadata()
+        with self.phase(phase):
+            fetched = sess.run(fetches, feed_dict=feed_dict, options=run_options,
+                run_metadata=run_metadata)
+        self._add_input_wait(run_metadata)
+        self.pending_traces.append((phase, run_metadata))
+        return fetched
+
+
+    def end_step(self, global_step, n_examples=None):
+        now = time.time()
+        self.n_steps += 1
+        self.history['step'].append(now - self.step_start)
+        for name, elapsed in self.current.items():
+            self.history[name].append(elapsed)
+        if n_examples is not None:
+            self.history['examples'].append(n_examples)
+        self.current = collections.defaultdict(float)
+        self.step_start = now
+
+        for phase, run_metadata in self.pending_traces:
+            self._save_trace(run_metadata, global_step, phase)
+        self.pending_traces = []
+
+        if self.report_every > 0 and self.n_steps % self.report_every == 0:
+            self.report(global_step)
+
+
+    """ Rolling means: seconds per phase and per step, and examples/s """
+    def summary(self):
+        means = {name: np.mean(values) for name, values in self.history.items()
+                 if name != 'examples' and len(values) > 0}
+        if len(self.history['examples']) > 0:
+            n_steps = len(self.history['examples'])
+            elapsed = np.sum(list(self.history['step'])[-n_steps:])
+            means['examples_per_sec'] = np.sum(self.history['examples']) / max(elapsed, 1e-9)
+        return means
+
+
+    def report(self, global_step):
+        means = self.summary()
+        values = []
+        for name, value in sorted(means.items()):
+            if name == 'examples_per_sec':
+                values.append(tf.Summary.Value(tag='profile/examples_per_sec', simple_value=value))
+            else:
+                values.append(tf.Summary.Value(tag='profile/{}_ms'.format(name),
+                    simple_value=value * 1000.))
+        if self.summary_writer is not None:
+            self.summary_writer.add_summary(tf.Summary(value=values), global_step)
+
+        print('[{:07d}] profile: {}'.format(global_step, ' '.join(
+            ['{}={:3.1f}ms'.format(name, value*1000.) for name, value in sorted(means.items())
+             if name != 'examples_per_sec'])), end='')
+        if 'examples_per_sec' in means:
+            print(' ({:3.1f} examples/s)'.format(means['examples_per_sec']))
+        else:
+            print('')
+
+
+    def _add_input_wait(self, run_metadata):
+        input_wait = 0
+        for dev_stats in run_metadata.step_stats.dev_stats:
+            for node_stats in dev_stats.node_stats:
+                if 'IteratorGetNext' in node_stats.node_name:
+                    input_wait += node_stats.all_end_rel_micros
+        self.current['input_wait'] += input_wait / 1e6
+
+
+    def _save_trace(self, run_metadata, global_step, phase):
+        trace = timeline.Timeline(run_metadata.step_stats).generate_chrome_trace_format()
+        trace_path = os.path.join(self.trace_dir,
+            'timeline_{:07d}_{}.json'.format(global_step, phase))
+        with open(trace_path, 'w') as f:
+            f.write(trace)
+        print('[{}] wrote trace {}'.format(self.name, trace_path))
+
+
+class NullProfiler(object):
+    @contextlib.contextmanager
+    def phase(self, name):
+        yield
+
+    def run(self, sess, fetches, feed_dict=None, phase='compute', trace=True):
+        return sess.run(fetches, feed_dict=feed_dict)
+
+    def end_step(self, global_step, n_examples=None):
+        pass
+
+    def summary(self):
+        return {}
+
+    def report(self, global_step):
+        pass
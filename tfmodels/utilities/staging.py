@@ -0,0 +1,70 @@
+from __future__ import print_function
+import tensorflow as tf
+from tensorflow.contrib.staging import StagingArea
+
+"""
+Double-buffered staging of dataset batches onto a device
+
+DeviceStager wraps any dataset exposing image_op, mask_op and/or label_op.
+It holds up to `capacity` batches in a StagingArea placed on `device`; the
+stager's own image_op/mask_op/label_op take the oldest staged batch.
+
+Run put_op alongside every step that consumes the staged ops, so the next
+batch is pulled from the dataset and copied to the device while the current
+step computes:
+
+    stager = DeviceStager(dataset, device='/gpu:0')
+    x = stager.image_op
+    ...
+    stager.prime(sess)
+    sess.run([train_op, stager.put_op])
+
+The area must be primed before the first step. When the dataset is
+re-initialized (e.g. switching to the test phase), clear() the area first
+and prime() again after, so no stale batches are served.
+"""
+
+class DeviceStager(object):
+    dataset_ops = ['image_op', 'mask_op', 'label_op']
+
+    def __init__(self, dataset, device=None, capacity=2, name='DeviceStager'):
+        self.capacity = capacity
+        self.device = device
+        self.name = name
+        self.op_names = [key for key in self.dataset_ops if hasattr(dataset, key)]
+        assert len(self.op_names) > 0, 'Dataset exposes none of {}'.format(self.dataset_ops)
+
+        tensors = [getattr(dataset, key) for key in self.op_names]
+        with tf.device(device), tf.name_scope(name):
+            self.area = StagingArea(dtypes=[t.dtype for t in tensors],
+                shapes=[t.get_shape() for t in tensors],
+                capacity=capacity)
+            self.put_op = self.area.put(tensors)
+            staged = self.area.get()
+            self.size_op = self.area.size()
+            self.clear_op = self.area.clear()
+
+        if not isinstance(staged, (list, tuple)):
+            staged = [staged]
+        for key, tensor in zip(self.op_names, staged):
+            setattr(self, key, tensor)
+
+
+    """ Stage batches until one step's worth of lookahead is buffered """
+    def prime(self, sess, n_batches=None):
+        if n_batches is None:
+            n_batches = self.capacity - 1
+        staged = sess.run(self.size_op)
+        for _ in range(max(n_batches - staged, 0)):
+            sess.run(self.put_op)
+
+
+    def clear(self, sess):
+        sess.run(self.clear_op)
+
+
+    def print_info(self):
+        print('-------------------- {} ---------------------- '.format(self.name))
+        for key, value in sorted(self.__dict__.items()):
+            print('|\t{}: {}'.format(key, value))
+        print('-------------------- {} ---------------------- '.format(self.name))
@@ -0,0 +1,68 @@
+from __future__ import print_function
+import numpy as np
+
+"""
+Online statistics for repeated stochastic forward passes (MC dropout, TTA).
+
+Welford's algorithm keeps a running mean and sum of squared deviations,
+so memory is constant in the number of samples:
+https://en.wikipedia.org/wiki/Algorithms_for_calculating_variance#Welford's_online_algorithm
+
+    moments = RunningMoments()
+    for _ in xrange(samples):
+        moments.update(model.inference(x_in, keep_prob=0.5))
+    y_bar_mean, y_bar_var = moments.mean, moments.variance
+
+"""
+class RunningMoments(object):
+    def __init__(self, dtype=np.float32):
+        self.dtype = dtype
+        self.count = 0
+        self.mean = None
+        self._m2 = None
+
+
+    def _allocate(self, shape):
+        self.mean = np.zeros(shape, dtype=self.dtype)
+        self._m2 = np.zeros(shape, dtype=self.dtype)
+        ## Scratch buffers reused by every update
+        self._delta = np.empty(shape, dtype=self.dtype)
+        self._scratch = np.empty(shape, dtype=self.dtype)
+
+
+    """ Add one sample with the accumulator's shape """
+    def update_one(self, x):
+        if self.mean is None:
+            self._allocate(x.shape)
+
+        self.count += 1
+        np.subtract(x, self.mean, out=self._delta)
+        np.divide(self._delta, self.count, out=self._scratch)
+        self.mean += self._scratch
+
+        ## m2 += (x - mean_old) * (x - mean_new)
+        np.subtract(x, self.mean, out=self._scratch)
+        self._scratch *= self._delta
+        self._m2 += self._scratch
+
+
+    """ Add a stack of samples, indexed along axis 0 """
+    def update(self, x):
+        x = np.asarray(x)
+        for x_i in x:
+            self.update_one(x_i)
+
+
+    @property
+    def variance(self):
+        ## Population variance; matches np.var(..., ddof=0)
+        if self.count == 0:
+            return None
+        return self._m2 / self.count
+
+
+    @property
+    def std(self):
+        if self.count == 0:
+            return None
+        return np.sqrt(self.variance)
@@ -0,0 +1,171 @@
+from __future__ import print_function
+import numpy as np
+
+"""
+Tiling helpers shared by the tfrecord writers and whole-image inference.
+
+Tiles are placed evenly: the first tile starts at 0 and the last tile ends flush
+with the image border, so every pixel is covered and overlaps are spread out.
+
+sliding_window_inference() runs a fixed-size model over an arbitrarily large
+image. The image only has to support numpy-style slicing (np.ndarray, np.memmap,
+h5py datasets, ...). Tiles are read, predicted and blended one batch at a time,
+and the blending weights are kept only for the band of rows still being written,
+so with a memmap'd `out` the full resolution never has to fit in memory.
+
+    y_hat = sliding_window_inference(model.inference, image, tile_size=[256, 256],
+        n_outputs=model.n_classes, stride=128)
+"""
+
+def tile_starts(length, tile_size, n_tiles):
+    if length <= tile_size:
+        return np.zeros(1, dtype=np.int64)
+    return np.linspace(0, length-tile_size, max(n_tiles, 2), dtype=np.int64)
+
+
+def stride_tile_count(length, tile_size, stride):
+    if length <= tile_size:
+        return 1
+    return int(np.ceil((length - tile_size) / float(stride))) + 1
+
+
+""" Return (y, x) upper left corners of tiles covering an (h, w) image
+
+Give either a stride, or the number of tiles along each axis with n_tiles=(n_h, n_w)
+"""
+def tile_coordinates(h, w, tile_size, stride=None, n_tiles=None):
+    if not isinstance(tile_size, (list, tuple)):
+        tile_size = [tile_size, tile_size]
+    th, tw = tile_size[:2]
+
+    if n_tiles is None:
+        assert stride is not None, 'tile_coordinates() requires either stride or n_tiles'
+        if not isinstance(stride, (list, tuple)):
+            stride = [stride, stride]
+        n_tiles = [stride_tile_count(h, th, stride[0]),
+                   stride_tile_count(w, tw, stride[1])]
+
+    coords = []
+    for y in tile_starts(h, th, n_tiles[0]):
+        for x in tile_starts(w, tw, n_tiles[1]):
+            coords.append((int(y), int(x)))
+    return coords
+
+
+""" Per-pixel tile weights for blending overlapping predictions
+
+'mean': uniform average of overlapping tiles
+'gaussian': down-weight tile borders, where the receptive field is truncated
+"""
+def blend_weights(tile_size, blend='gaussian'):
+    th, tw = tile_size[:2]
+    if blend == 'mean':
+        return np.ones((th, tw), dtype=np.float32)
+    elif blend == 'gaussian':
+        gy = np.exp(-0.5 * np.square((np.arange(th) - (th-1)/2.0) / (th/4.0)))
+        gx = np.exp(-0.5 * np.square((np.arange(tw) - (tw-1)/2.0) / (tw/4.0)))
+        weights = np.outer(gy, gx).astype(np.float32)
+        return np.maximum(weights / weights.max(), 1e-3)
+    else:
+        raise Exception('blend must be one of [mean, gaussian]; got {}'.format(blend))
+
+
+""" Read one tile, zero padding past the image border """
+def _read_tile(image, y, x, th, tw):
+    tile = np.asarray(image[y:y+th, x:x+tw, ...])
+    if tile.shape[0] == th and tile.shape[1] == tw:
+        return tile
+
+    padded = np.zeros((th, tw) + tile.shape[2:], dtype=tile.dtype)
+    padded[:tile.shape[0], :tile.shape[1], ...] = tile
+    return padded
+
+
+""" True if any foreground falls under the tile. The mask may have any resolution;
+it is assumed to cover the whole (h, w) image """
+def _has_foreground(foreground, y, x, th, tw, h, w):
+    scale_y = foreground.shape[0] / float(h)
+    scale_x = foreground.shape[1] / float(w)
+    y0, x0 = int(y * scale_y), int(x * scale_x)
+    y1 = max(int(np.ceil((y + th) * scale_y)), y0+1)
+    x1 = max(int(np.ceil((x + tw) * scale_x)), x0+1)
+    return bool(np.any(foreground[y0:y1, x0:x1]))
+
+
+""" Blend a batch of tiles into out. Weights accumulate in `band`, which holds
+image rows [band_y0, band_y0 + len(band)); it is grown as tiles need more rows """
+def _blend_batch(y_hat, coords, out, band, band_y0, weights):
+    h, w = out.shape[:2]
+    th, tw = weights.shape
+    for y_hat_, (y, x) in zip(y_hat, coords):
+        vh, vw = min(th, h-y), min(tw, w-x)
+        if y + vh - band_y0 > band.shape[0]:
+            grow = np.zeros((y + vh - band_y0 - band.shape[0], w), dtype=np.float32)
+            band = np.concatenate([band, grow], axis=0)
+        wt = weights[:vh, :vw]
+        out[y:y+vh, x:x+vw, :] += y_hat_[:vh, :vw, :] * wt[:, :, np.newaxis]
+        band[y-band_y0:y-band_y0+vh, x:x+vw] += wt
+    return band
+
+
+""" Normalize rows [band_y0, y_end) of out, which no remaining tile touches, and drop
+them from the weight band """
+def _finish_rows(out, band, band_y0, y_end, weight_sum=None):
+    n_rows = min(y_end - band_y0, band.shape[0])
+    if n_rows > 0:
+        ws = band[:n_rows]
+        if weight_sum is not None:
+            weight_sum[band_y0:band_y0+n_rows] = ws
+        out[band_y0:band_y0+n_rows] /= np.where(ws > 0, ws, 1.0)[:, :, np.newaxis]
+    return band[max(n_rows, 0):], y_end
+
+
+"""
+predict_fn maps a (batch, th, tw, c) float32 array to (batch, th, tw, n_outputs).
+preprocess_fn, if given, is applied to each batch of raw tiles before predict_fn,
+e.g. to rescale uint8 tiles into [-1, 1] without copying the whole image to float.
+
+foreground, if given, is a boolean mask covering the image at any resolution
+(e.g. SVSFeeder.tissue_mask). Tiles without foreground are skipped and left at 0.
+
+out may be passed in preallocated (e.g. np.memmap). Tiles are visited row by row
+and blending weights are only kept for the rows still being written, about
+(tile_h + the rows spanned by one batch) x w; each band of out is normalized as
+soon as no later tile overlaps it. Pass weight_sum (h, w) to also keep the
+per-pixel weight totals.
+Returns out, holding the blended (h, w, n_outputs) prediction.
+"""
+def sliding_window_inference(predict_fn, image, tile_size, n_outputs, stride=None,
+    batch_size=8, blend='gaussian', preprocess_fn=None, foreground=None, out=None,
+    weight_sum=None, verbose=False):
+    h, w = image.shape[:2]
+    th, tw = tile_size[:2]
+    if stride is None:
+        stride = [th // 2, tw // 2]
+
+    if out is None:
+        out = np.zeros((h, w, n_outputs), dtype=np.float32)
+    weights = blend_weights([th, tw], blend=blend)
+
+    ## Row-major order, so finished rows can be normalized and their weights dropped
+    coords = sorted(tile_coordinates(h, w, [th, tw], stride=stride))
+    if foreground is not None:
+        coords = [(y, x) for y, x in coords if _has_foreground(foreground, y, x, th, tw, h, w)]
+    if verbose:
+        print('Sliding window: {} tiles of {} over {}'.format(len(coords), [th, tw], [h, w]))
+
+    band = np.zeros((0, w), dtype=np.float32)
+    band_y0 = 0
+    for start in range(0, len(coords), batch_size):
+        batch_coords = coords[start:start+batch_size]
+        batch = np.stack([_read_tile(image, y, x, th, tw) for y, x in batch_coords], axis=0)
+        if preprocess_fn is not None:
+            batch = preprocess_fn(batch)
+        y_hat = predict_fn(batch.astype(np.float32))
+        band = _blend_batch(y_hat, batch_coords, out, band, band_y0, weights)
+
+        ## Rows above the next tile are final
+        next_y = coords[start+batch_size][0] if start+batch_size < len(coords) else h
+        band, band_y0 = _finish_rows(out, band, band_y0, next_y, weight_sum)
+
+    return out
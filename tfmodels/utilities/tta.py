@@ -0,0 +1,60 @@
+from __future__ import print_function
+import tensorflow as tf
+
+"""
+In-graph test-time augmentation
+
+Views are the dihedral group of the image: every combination of transpose,
+vertical and horizontal flip, which covers the four 90 degree rotations and
+their mirror images. Transposing needs a square input, so non-square inputs
+get the 4 flips only.
+
+    transforms = dihedral_transforms(square=True)     ## 8 views
+    x_views = tta_views(x_in, transforms)             ## (8*n, h, w, c)
+    y_views = tta_invert(model(x_views), transforms)  ## (8, n, h, w, k), aligned to x_in
+    y_tta = tf.reduce_mean(y_views, axis=0)
+
+Views are concatenated along the batch axis, so all of them share one forward
+pass. Every transform is its own inverse, applied in reverse order.
+"""
+
+def dihedral_transforms(square=True):
+    transforms = []
+    for transpose in ([False, True] if square else [False]):
+        for flip_ud in [False, True]:
+            for flip_lr in [False, True]:
+                transforms.append((transpose, flip_ud, flip_lr))
+    return transforms
+
+
+def _transform(x, transpose, flip_ud, flip_lr):
+    if transpose:
+        x = tf.transpose(x, perm=[0, 2, 1, 3])
+    if flip_ud:
+        x = tf.reverse(x, axis=[1])
+    if flip_lr:
+        x = tf.reverse(x, axis=[2])
+    return x
+
+
+def _inverse(y, transpose, flip_ud, flip_lr):
+    if flip_lr:
+        y = tf.reverse(y, axis=[2])
+    if flip_ud:
+        y = tf.reverse(y, axis=[1])
+    if transpose:
+        y = tf.transpose(y, perm=[0, 2, 1, 3])
+    return y
+
+
+""" x (n, h, w, c) --> (len(transforms)*n, h, w, c), view-major """
+def tta_views(x, transforms):
+    with tf.name_scope('tta_views'):
+        return tf.concat([_transform(x, *t) for t in transforms], axis=0)
+
+
+""" y (len(transforms)*n, h, w, k) --> (len(transforms), n, h, w, k) in the input's orientation """
+def tta_invert(y, transforms):
+    with tf.name_scope('tta_invert'):
+        views = tf.split(y, len(transforms), axis=0)
+        return tf.stack([_inverse(view, *t) for view, t in zip(views, transforms)], axis=0)